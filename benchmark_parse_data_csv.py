@@ -0,0 +1,113 @@
+from providers import seventeen_lands
+import argparse
+import functools
+import numpy as np
+import os
+import pandas as pd
+import time
+import tracemalloc
+
+
+def write_synthetic_csv(csv_path,num_rows,num_cards,seed=0,chunk_rows=100000):
+    """
+    17lands-like draft csv: draft_id, pick, pack_card_* flags and pool_* counts
+    """
+    rng = np.random.default_rng(seed)
+    card_names = ['Card {}'.format(idx) for idx in range(num_cards)]
+    columns = (['draft_id','pick'] + ['pack_card_'+name for name in card_names]
+               + ['pool_'+name for name in card_names])
+    for start in range(0,num_rows,chunk_rows):
+        num_chunk_rows = min(chunk_rows,num_rows - start)
+        packs = (rng.random((num_chunk_rows,num_cards)) < 8/num_cards).astype(np.uint8)
+        pools = rng.binomial(2,10/num_cards,size=(num_chunk_rows,num_cards)).astype(np.uint8)
+        picks = rng.integers(num_cards,size=num_chunk_rows)
+        df = pd.DataFrame(np.concatenate([packs,pools],axis=1),columns=columns[2:])
+        df.insert(0,'pick',[card_names[idx] for idx in picks])
+        df.insert(0,'draft_id',(start + np.arange(num_chunk_rows)) // 42)
+        df.to_csv(csv_path,mode='w' if start == 0 else 'a',header=start == 0,index=False)
+
+
+def parse_data_csv_vstack(csv_path):
+    """
+    The previous parse_data_csv dense path, growing the arrays with np.vstack
+    on every chunk
+    """
+    pack_cols,pool_cols,pack_names_no_prefix,inv_map = seventeen_lands.read_csv_columns(csv_path)
+    picked_names = []
+    pack_tensor = None
+    pool_tensor = None
+    for data_df in pd.read_csv(csv_path, chunksize=10000):
+        if pack_tensor is None:
+            pack_tensor = data_df[pack_cols].values.astype(np.uint8)
+        else:
+            pack_tensor = np.vstack([pack_tensor,
+                                    data_df[pack_cols].values.astype(np.uint8)])
+        if pool_tensor is None:
+            pool_tensor = data_df[pool_cols].values.astype(np.uint8)
+        else:
+            pool_tensor = np.vstack([pool_tensor,
+                                    data_df[pool_cols].values.astype(np.uint8)])
+        picked_names.extend(data_df['pick'])
+
+    data = np.concatenate([pool_tensor,pack_tensor],axis=1)
+    target = np.zeros_like(pack_tensor,dtype=np.uint8)
+    for n,name in enumerate(picked_names):
+        target[n,inv_map[name]] = 1
+    return data,target
+
+
+def run(name,parse_fn,csv_path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    data,target = parse_fn(csv_path)[:2]
+    elapsed = time.perf_counter() - start
+    _,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    output_bytes = data.nbytes + target.nbytes
+    print('{:>8} : {:.1f}s , {:.0f} rows/s , peak traced memory {:.0f} MB ({:.2f}x the output arrays)'.format(
+        name,elapsed,len(data)/elapsed,peak/2**20,peak/output_bytes))
+    return data,target
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "--csv_path", action="store", dest="csv_path",
+        default="synthetic_draft_data.csv",
+        help=("csv to parse, a synthetic one is written there if it doesn't exist")
+    )
+    parser.add_argument(
+        "--num_rows", action="store", dest="num_rows",
+        default=2000000,type=int,
+        help=("number of rows of the synthetic csv")
+    )
+    parser.add_argument(
+        "--num_cards", action="store", dest="num_cards",
+        default=100,type=int,
+        help=("number of cards in the set of the synthetic csv")
+    )
+    parser.add_argument(
+        "--skip_vstack", action="store_true", dest="skip_vstack",
+        help=("don't run the previous np.vstack parser (it is quadratic in the number of rows)")
+    )
+    parser.add_argument(
+        "--csv_engine", action="store", dest="csv_engine",
+        default="auto",choices=["auto","c","pyarrow"],
+        help=("csv parser of parse_data_csv, 'auto' uses pyarrow when it is installed")
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.csv_path):
+        print('writing {} rows to {}...'.format(args.num_rows,args.csv_path))
+        write_synthetic_csv(args.csv_path,args.num_rows,args.num_cards)
+
+    data,target = run('prealloc',functools.partial(seventeen_lands.parse_data_csv,
+                                                   engine=args.csv_engine),
+                      args.csv_path)
+    if not args.skip_vstack:
+        vstack_data,vstack_target = run('vstack',parse_data_csv_vstack,args.csv_path)
+        if not (np.array_equal(data,vstack_data) and np.array_equal(target,vstack_target)):
+            raise Exception("the parsers' outputs differ")
@@ -0,0 +1,65 @@
+from nn_utils import load_model
+from rollout_bot import RolloutBot
+from set_utils import get_set_metadata
+from sim_utils import DraftSimulator
+import argparse
+import numpy as np
+import time
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "--model_hdf5", action="store", dest="model_hdf5",
+        required=True,
+        help=("path to the model_hdf5, or to a .npz exported by export_numpy_model.py")
+    )
+    parser.add_argument(
+        "--set_code", action="store", dest="set_code",
+        required=True,
+        help=("3-symbol code for the set")
+    )
+    parser.add_argument(
+        "--num_rollouts", action="store", dest="num_rollouts",
+        default=[4,16,64],type=int,nargs='+',
+        help=("numbers of rollouts per candidate to benchmark")
+    )
+    parser.add_argument(
+        "--num_decisions", action="store", dest="num_decisions",
+        default=10,type=int,
+        help=("number of decisions timed per num_rollouts")
+    )
+    parser.add_argument(
+        "--seed", action="store", dest="seed",
+        default=0,type=int,
+        help=("random seed")
+    )
+    args = parser.parse_args()
+
+    model = load_model(args.model_hdf5)
+    draft_coord = get_set_metadata(args.set_code).load_draft_creator()
+    rng = np.random.default_rng(args.seed)
+
+    #table states to decide from, at random picks of the first pack
+    states = []
+    for _ in range(args.num_decisions):
+        simulator = DraftSimulator(model,draft_coord,1,rng=rng)
+        simulator.open_packs()
+        for _ in range(rng.integers(draft_coord.pack_size - 1)):
+            simulator.pick_round()
+        states.append((simulator.packs[0].copy(),simulator.pools[0].copy(),
+                       simulator.pack_num,simulator.pick_num))
+
+    for num_rollouts in args.num_rollouts:
+        bot = RolloutBot(model,draft_coord,num_rollouts=num_rollouts,rng=rng)
+        latencies = []
+        total_rollouts = 0
+        for packs,pools,pack_num,pick_num in states:
+            start = time.perf_counter()
+            candidates,_ = bot.score_candidates(packs,pools,pack_num,pick_num)
+            latencies.append(time.perf_counter() - start)
+            total_rollouts += len(candidates)*num_rollouts
+        print('num_rollouts: {:4d} , latency per decision: {:.3f}s (max {:.3f}s) , rollouts/sec: {:.1f}'.format(
+            num_rollouts,np.mean(latencies),np.max(latencies),total_rollouts/np.sum(latencies)))
@@ -10,6 +10,7 @@ import multiprocessing
 import draftsimtools as ds
 from providers import seventeen_lands
 import argparse
+import utils
 
 import dill as pickle
 if __name__ == '__main__':
@@ -19,30 +20,109 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         "--data_csv", action="store", dest="data_csv",
-        required=True,
-        help=("path to the data_folder (as downloaded from 17lands)")
+        default=None,
+        help=("path to the data_folder (as downloaded from 17lands), required without --parquet_cache")
     )
     parser.add_argument(
         "--train_split", action="store", dest="train_split",
         default=0.8,type=float,
         help=("fraction of data to use for training ")
     )
+    parser.add_argument(
+        "--output_format", action="store", dest="output_format",
+        default="pkl",choices=["pkl","npy"],
+        help=("'pkl' saves _train_data.pkl/_test_data.pkl, 'npy' saves "
+              "_train_data/_test_data dataset directories that train_nn.py memory-maps")
+    )
+    parser.add_argument(
+        "--storage", action="store", dest="storage",
+        default="csr",choices=["csr","packed","draft","dense"],
+        help=("'csr' stores the pool/pack rows as CSR arrays and the picks as indices, "
+              "'packed' stores the pools as CSR arrays and the pack flags as bits, "
+              "'draft' stores the complete drafts as a draft tensor (as the draftsim data) "
+              "and the rows of the other drafts as CSR arrays, "
+              "'dense' stores them as dense uint8 arrays")
+    )
+    parser.add_argument(
+        "--workers", action="store", dest="workers",
+        default=1,type=int,
+        help=("number of processes parsing the csv, each one parses newline aligned byte ranges of it")
+    )
+    parser.add_argument(
+        "--csv_engine", action="store", dest="csv_engine",
+        default="auto",choices=["auto","c","pyarrow"],
+        help=("csv parser, 'auto' uses pyarrow when it is installed, pandas' 'c' parser otherwise")
+    )
+    parser.add_argument(
+        "--parquet_cache", action="store", dest="parquet_cache",
+        default=None,
+        help=("directory of a Parquet cache of 17lands dumps, partitioned by event_type and "
+              "draft_time month. --data_csv, if given, is added to it first (once), and the "
+              "datasets are built from the cache")
+    )
+    parser.add_argument(
+        "--filter", action="append", dest="filters",
+        default=[],
+        help=("row filter for --parquet_cache, 'column op value' with op one of "
+              "==,!=,>=,<=,>,<, e.g. 'rank>=gold', 'draft_time>=2021-05-01', "
+              "'event_type==PremierDraft'. Can be repeated, rows must pass all filters. "
+              "Rows without a known rank never pass a rank filter")
+    )
     args = parser.parse_args()
+    if args.data_csv is None and args.parquet_cache is None:
+        parser.error('--data_csv or --parquet_cache is required')
+    if args.filters and args.parquet_cache is None:
+        parser.error('--filter requires --parquet_cache')
 
     # card_name_df = pd.read_csv(args.card_name_csv)
 
-    print('parsing data...')
-    data,target,card_name_df = seventeen_lands.parse_data_csv(args.data_csv)
+    if args.parquet_cache is not None:
+        if args.data_csv is not None:
+            print('adding {} to the parquet cache...'.format(args.data_csv))
+            if not seventeen_lands.build_parquet_cache(args.data_csv,args.parquet_cache):
+                print('already in the cache')
+        print('reading parquet cache...')
+        data,target,card_name_df = seventeen_lands.parse_data_parquet(args.parquet_cache,
+                                                                      storage=args.storage,
+                                                                      filters=args.filters)
+        output_prefix = os.path.normpath(args.parquet_cache)
+    else:
+        print('parsing data...')
+        data,target,card_name_df = seventeen_lands.parse_data_csv(args.data_csv,
+                                                                  storage=args.storage,
+                                                                  workers=args.workers,
+                                                                  engine=args.csv_engine)
+        output_prefix = os.path.splitext(args.data_csv)[0]
     
-    num_samples = data.shape[0]
+    num_samples = target.shape[0]
     train_samples = int(args.train_split*num_samples)
-    train_data,train_target = data[:train_samples],target[:train_samples]
-    test_data,test_target = data[train_samples:],target[train_samples:]
+    if args.storage == 'draft':
+        drafts = data.pop('drafts')
+        print('{} complete drafts, {} rows of incomplete drafts'.format(len(drafts),num_samples))
+        csr_dict = dict(data,pick=target,data_format='mixed',
+                        num_cards_in_set=len(card_name_df))
+        #the drafts and the other rows are split separately
+        train_drafts = int(args.train_split*len(drafts))
+        train_dict = dict(utils.slice_csr(csr_dict,0,train_samples),drafts=drafts[:train_drafts])
+        test_dict = dict(utils.slice_csr(csr_dict,train_samples,num_samples),
+                         drafts=drafts[train_drafts:])
+    elif args.storage in ('csr','packed'):
+        csr_dict = dict(data,pick=target,data_format=args.storage,
+                        num_cards_in_set=len(card_name_df))
+        train_dict = utils.slice_csr(csr_dict,0,train_samples)
+        test_dict = utils.slice_csr(csr_dict,train_samples,num_samples)
+    else:
+        train_data,train_target = data[:train_samples],target[:train_samples]
+        test_data,test_target = data[train_samples:],target[train_samples:]
+        train_dict = {'x':train_data,'y':train_target,'data_format':'sparse'}
+        test_dict = {'x':test_data,'y':test_target,'data_format':'sparse'}
 
-    print('saving pkls...')
-    output_prefix = os.path.splitext(args.data_csv)[0]
-    pickle.dump({'x':train_data,'y':train_target,'data_format':'sparse'},
-                open(output_prefix+'_train_data.pkl','wb'))
-    pickle.dump({'x':test_data,'y':test_target,'data_format':'sparse'},
-                open(output_prefix+'_test_data.pkl','wb'))
+    if args.output_format == 'npy':
+        print('saving datasets...')
+        utils.save_dataset(output_prefix+'_train_data',train_dict)
+        utils.save_dataset(output_prefix+'_test_data',test_dict)
+    else:
+        print('saving pkls...')
+        pickle.dump(train_dict,open(output_prefix+'_train_data.pkl','wb'))
+        pickle.dump(test_dict,open(output_prefix+'_test_data.pkl','wb'))
     card_name_df.to_csv(output_prefix+'_card_names.csv',index=False)
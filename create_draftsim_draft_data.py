@@ -11,6 +11,7 @@ import multiprocessing
 import draftsimtools as ds
 
 import argparse
+import utils
 
 if __name__ == '__main__':
 
@@ -27,6 +28,12 @@ if __name__ == '__main__':
         default=0.8,type=float,
         help=("fraction of data to use for training ")
     )
+    parser.add_argument(
+        "--output_format", action="store", dest="output_format",
+        default="pkl",choices=["pkl","npy"],
+        help=("'pkl' saves train_drafts.pkl/test_drafts.pkl, 'npy' saves "
+              "train_drafts/test_drafts dataset directories that train_nn.py memory-maps")
+    )
     args = parser.parse_args()
     data_folder = args.data_folder
     train_split = args.train_split
@@ -69,8 +76,12 @@ if __name__ == '__main__':
     num_train = int(train_split*num_drafts)
     train_data = pick_tensor[:num_train]
     test_data = pick_tensor[num_train:]
-    pickle.dump(train_data,open(train_output,'wb'))
-    pickle.dump(test_data,open(test_output,'wb'))
+    if args.output_format == 'npy':
+        utils.save_dataset(os.path.splitext(train_output)[0],train_data)
+        utils.save_dataset(os.path.splitext(test_output)[0],test_data)
+    else:
+        pickle.dump(train_data,open(train_output,'wb'))
+        pickle.dump(test_data,open(test_output,'wb'))
 
 
     
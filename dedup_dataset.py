@@ -0,0 +1,45 @@
+import argparse
+import os
+import pickle
+import numpy as np
+import utils
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "--input_pkl", action="store", dest="input_pkl",
+        required=True,
+        help=("path to a train/test pkl, or to a dataset directory (see utils.save_dataset)")
+    )
+    parser.add_argument(
+        "--output", action="store", dest="output",
+        required=True,
+        help=("output pkl path, or dataset directory for --output_format npy")
+    )
+    parser.add_argument(
+        "--output_format", action="store", dest="output_format",
+        default="npy",choices=["pkl","npy"],
+        help=("'pkl' saves a pkl, 'npy' saves a dataset directory that train_nn.py memory-maps")
+    )
+    parser.add_argument(
+        "--block_size", action="store", dest="block_size",
+        default=65536,type=int,
+        help=("number of samples read at a time")
+    )
+    args = parser.parse_args()
+
+    processor = utils.open_processor(args.input_pkl)
+    print('hashing {} samples...'.format(len(processor)))
+    dedup_dict = utils.dedup_samples(processor,block_size=args.block_size)
+    num_unique = len(dedup_dict['count'])
+    print('{} unique samples out of {}, dedup ratio: {:.2f}x'.format(
+        num_unique,len(processor),len(processor)/max(num_unique,1)))
+
+    if args.output_format == 'npy':
+        utils.save_dataset(args.output,dedup_dict)
+    else:
+        pickle.dump(dedup_dict,open(args.output,'wb'))
@@ -0,0 +1,89 @@
+from numpy_model import fold_keras_model, pick_agreement
+import argparse
+import keras
+import numpy as np
+import os
+import utils
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "--model_hdf5", action="store", dest="model_hdf5",
+        required=True,
+        help=("path to the model_hdf5 ")
+    )
+    parser.add_argument(
+        "--output_npz", action="store", dest="output_npz",
+        required=True,
+        help=("path to the output npz, can be used instead of the hdf5 "
+              "in simulate_draft.py and play_draft.py")
+    )
+    parser.add_argument(
+        "--num_check", action="store", dest="num_check",
+        default=1000,type=int,
+        help=("number of random inputs used to check the numpy model "
+              "against the keras model")
+    )
+    parser.add_argument(
+        "--atol", action="store", dest="atol",
+        default=1e-3,type=float,
+        help=("max absolute difference allowed between the numpy and keras outputs")
+    )
+    parser.add_argument(
+        "--precision", action="store", dest="precision",
+        default="float32",choices=["float32","float16","int8"],
+        help=("precision used to store the kernels in the output npz, only makes the npz "
+              "smaller, the picks are still computed in float32")
+    )
+    parser.add_argument(
+        "--test_pkl", action="store", dest="test_pkl",
+        default=None,
+        help=("path to a test_pkl (or dataset directory), if given, reports how often the exported model "
+              "picks the same card as the float32 model on it")
+    )
+    parser.add_argument(
+        "--num_test", action="store", dest="num_test",
+        default=100000,type=int,
+        help=("max number of samples of the test_pkl used for the pick agreement")
+    )
+    args = parser.parse_args()
+
+    keras_model = keras.models.load_model(args.model_hdf5)
+    numpy_model = fold_keras_model(keras_model)
+    set_size = numpy_model.set_size
+
+    #random pools of 0 to 44 picks, and random packs
+    rng = np.random.default_rng(0)
+    model_input = np.zeros((args.num_check,2*set_size),dtype=np.float32)
+    for row in model_input:
+        num_picks = rng.integers(45)
+        np.add.at(row,rng.integers(set_size,size=num_picks),1)
+        row[set_size + rng.choice(set_size,size=15,replace=False)] = 1
+    keras_out = keras_model.predict(model_input)
+    numpy_out = numpy_model.predict(model_input)
+    max_diff = np.max(np.abs(keras_out - numpy_out))
+    keras_agreement = np.mean(np.argmax(keras_out,axis=1) == np.argmax(numpy_out,axis=1))
+    print('max abs difference: {}'.format(max_diff))
+    print('argmax agreement: {}'.format(keras_agreement))
+    if max_diff > args.atol:
+        raise Exception("numpy model output differs from the keras model by {}".format(max_diff))
+
+    if args.precision != "float32":
+        quantized_model = numpy_model.quantize(args.precision)
+        agreement = pick_agreement(quantized_model,numpy_model,model_input)
+        print('{} argmax agreement with float32 (random inputs): {}'.format(args.precision,agreement))
+        if args.test_pkl is not None:
+            test_processor = utils.open_processor(args.test_pkl)
+            num_test = min(args.num_test,len(test_processor))
+            test_indices = np.random.default_rng(0).choice(len(test_processor),size=num_test,replace=False)
+            test_input,_ = test_processor.get_batch(np.sort(test_indices))
+            agreement = pick_agreement(quantized_model,numpy_model,test_input)
+            print('{} argmax agreement with float32 ({} samples of {}): {}'.format(
+                args.precision,num_test,args.test_pkl,agreement))
+        numpy_model = quantized_model
+
+    numpy_model.save(args.output_npz)
+    print('saved {} ({:.1f} MB)'.format(args.output_npz,os.path.getsize(args.output_npz)/2**20))
@@ -1,11 +1,26 @@
-import keras
-import keras.layers as KL
 import numpy as np
-import scipy
 import warnings
+from collections import OrderedDict
+from numpy_model import NumpyModel
+
+
+def load_model(model_path):
+    """
+    Loads either an exported NumpyModel (.npz) or a keras model (.hdf5).
+    keras is only imported for keras models.
+    """
+    if model_path.endswith(".npz"):
+        return NumpyModel.load(model_path)
+    import keras
+
+    return keras.models.load_model(model_path)
 
 
 def build_model(input_size, num_dense=3):
+    # imported here so the bots can run on a NumpyModel without keras
+    import keras
+    import keras.layers as KL
+
     input_layer = KL.Input(shape=(input_size,))
     set_size = input_size // 2
     deck = KL.Lambda(lambda x: x[:, :set_size], output_shape=(set_size,))(input_layer)
@@ -26,33 +41,168 @@ def build_model(input_size, num_dense=3):
     return model
 
 
+def pool_logits(keras_model, pools, batch_size=None):
+    """
+    Unmasked logits for (batch, set_size) pools. In build_model the pack half
+    of the input only multiplies the final logits, so they are computed with
+    every card 'in the pack'.
+    """
+    pools = np.asarray(pools, dtype=np.float32)
+    model_input = np.concatenate([pools, np.ones_like(pools)], axis=1)
+    if batch_size is None:
+        return keras_model.predict(model_input)
+    return keras_model.predict(model_input, batch_size=batch_size)
+
+
+def gumbel_max_sample(logits, pack_mask, temperature=1.0, top_k=None, rng=None):
+    """
+    Samples one card per row from softmax(logits / temperature), restricted
+    to the cards in the pack (pack_mask) and, if top_k is set, to the top_k
+    cards of the pack. Uses the Gumbel-max trick: argmax of the logits plus
+    Gumbel noise, so every row is a single draw, always in the pack.
+
+    logits and pack_mask are (batch, set_size), temperature is a scalar or
+    a (batch, 1) array. Returns the (batch,) picked card indices.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    if np.any(np.asarray(temperature) <= 0):
+        raise ValueError("temperature must be positive")
+    scores = np.where(pack_mask, logits / temperature, -np.inf)
+    if top_k is not None and top_k < scores.shape[1]:
+        kth_score = -np.partition(-scores, top_k - 1, axis=1)[:, top_k - 1 : top_k]
+        scores = np.where(scores >= kth_score, scores, -np.inf)
+    return np.argmax(scores + rng.gumbel(size=scores.shape), axis=1)
+
+
+class LogitCache(object):
+    def __init__(self, max_size=4096):
+        """
+        LRU cache of unmasked logits, keyed on the pool count vector. The
+        logits only depend on the pool (see pool_logits), so a cache can be
+        shared by every bot using the same model.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def key(pool):
+        return np.asarray(pool, dtype=np.int16).tobytes()
+
+    def get(self, pool):
+        key = self.key(pool)
+        logits = self._cache.get(key)
+        if logits is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        return logits
+
+    def put(self, pool, logits):
+        key = self.key(pool)
+        self._cache[key] = logits
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._cache),
+            "max_size": self.max_size,
+        }
+
+
 class NNBot(object):
-    def __init__(self, keras_model, set_size, pick_mode="max", invalid_mode=-1):
+    def __init__(
+        self,
+        keras_model,
+        set_size,
+        pick_mode="max",
+        invalid_mode=-1,
+        logit_cache=None,
+        temperature=1.0,
+        top_k=None,
+        rng=None,
+    ):
         """
         Note the NNBot handles the already picked card values differently from
         the training code/pkls. picked cards will be set to -1, instead of 0. This
         means that the NNBot doesn't need to keep track of the pick num
         TODO: handle the training data of picked cards
+
+        If a LogitCache is given, the unmasked logits for the current picks are
+        looked up in it, and the pack mask is applied afterwards.
+
+        pick_mode "gumbel" samples the pick among the cards in the pack (see
+        gumbel_max_sample), with temperature, top_k and rng.
         """
         self.keras_model = keras_model
         self.set_size = set_size
         self.pick_mode = pick_mode
         self.invalid_mode = invalid_mode
-        self.reset_picks()
+        self.logit_cache = logit_cache
+        self.temperature = temperature
+        self.top_k = top_k
+        if rng is None:
+            rng = np.random.default_rng()
+        self.rng = rng
+        self.bind_input_buffer(np.zeros((2 * self.set_size), dtype=np.float32))
+
+    def bind_input_buffer(self, input_buffer):
+        """
+        The model input is kept in one persistent float32 buffer of size
+        2*set_size: self.picks is a view of the first half and self.pack_vec
+        a view of the second half. input_buffer can be a row of a shared seat
+        matrix (see TablePicker), the current picks are copied into it.
+        """
+        if hasattr(self, "picks"):
+            input_buffer[: self.set_size] = self.picks
+        else:
+            input_buffer[: self.set_size] = 0
+        self.input_buffer = input_buffer
+        self.picks = input_buffer[: self.set_size]
+        self.pack_vec = input_buffer[self.set_size :]
 
     def reset_picks(self):
-        self.picks = np.zeros((self.set_size))
+        self.input_buffer[:] = 0
 
     def pack_probs(self, pack):
-        model_input = self.pack_to_model_input(pack)
-        out = self.keras_model.predict(np.expand_dims(model_input, 0))
+        self.write_pack(pack)
+        if self.logit_cache is not None:
+            return self.cached_logits() * self.pack_vec
+        out = self.keras_model.predict(self.input_buffer[None])
         return np.squeeze(out, axis=0)
 
+    def cached_logits(self):
+        logits = self.logit_cache.get(self.picks)
+        if logits is None:
+            logits = pool_logits(self.keras_model, np.expand_dims(self.picks, 0))[0]
+            self.logit_cache.put(self.picks, logits)
+        return logits
+
     def pick(self, pack):
         out = self.pack_probs(pack)
+        return self.pick_from_probs(out, pack)
+
+    def pick_from_probs(self, out, pack):
         if self.pick_mode == "max":
             return np.argmax(out)
         elif self.pick_mode == "sample":
+            import scipy.special
+
             probs = scipy.special.softmax(out)
             probs[probs < 5e-4] = 0
             pick = np.argmax(np.random.multinomial(1, probs))
@@ -60,9 +210,22 @@ class NNBot(object):
                 print("pick not found in pack,trying again")
                 pick = np.argmax(np.random.multinomial(1, probs))
             return pick
+        elif self.pick_mode == "gumbel":
+            self.write_pack(pack)
+            pack_mask = self.pack_vec > 0
+            return gumbel_max_sample(
+                out[None],
+                pack_mask[None],
+                temperature=self.temperature,
+                top_k=self.top_k,
+                rng=self.rng,
+            )[0]
 
     def pick_and_add(self, pack):
         card_idx = self.pick(pack)
+        return self.add_pick(pack, card_idx)
+
+    def add_pick(self, pack, card_idx):
         out_pack = pack.tolist()
 
         if card_idx not in out_pack:
@@ -93,7 +256,145 @@ class NNBot(object):
                 raise NotImplementedError("unknown invalid_mode")
         return vec
 
+    def write_pack(self, pack):
+        """
+        Writes the pack vector into the second half of the input buffer
+        """
+        if self.invalid_mode != -1:
+            raise NotImplementedError("unknown invalid_mode")
+        pack = np.asarray(pack)
+        self.pack_vec[:] = 0
+        self.pack_vec[pack[pack != -1]] = 1
+
     def pack_to_model_input(self, pack):
-        vec = self.pack_to_vec(pack)
-        model_input = np.concatenate((self.picks, vec))
-        return model_input
+        """
+        Returns the input buffer (not a copy) with the pack written in it
+        """
+        self.write_pack(pack)
+        return self.input_buffer
+
+
+class TablePicker(object):
+    def __init__(self, bot_list):
+        """
+        Picks for every seat at the table with a single model call per pick
+        round, instead of one predict call per bot. All bots must share the
+        same keras_model. The picks (including the fallback when the bot picks
+        a card that isn't in the pack) are made by each bot, so the result is
+        the same as calling pick_and_add on each bot in turn.
+        """
+        self.bot_list = bot_list
+        self.keras_model = bot_list[0].keras_model
+        self.set_size = bot_list[0].set_size
+        for bot in bot_list:
+            if bot.keras_model is not self.keras_model:
+                raise ValueError("all bots in a TablePicker must share the same model")
+
+        # seat matrix, each bot's input buffer is a row of it
+        self.model_input = np.zeros(
+            (len(bot_list), 2 * self.set_size), dtype=np.float32
+        )
+        for bot, row in zip(bot_list, self.model_input):
+            bot.bind_input_buffer(row)
+        self.pack_vecs = self.model_input[:, self.set_size :]
+
+    def __len__(self):
+        return len(self.bot_list)
+
+    def write_packs(self, packs):
+        """
+        Writes the pack vectors of every seat into the seat matrix
+        """
+        packs = np.asarray(packs)
+        row_idx, slot_idx = np.nonzero(packs != -1)
+        self.pack_vecs[:] = 0
+        self.pack_vecs[row_idx, packs[row_idx, slot_idx]] = 1
+
+    def pack_probs(self, packs):
+        self.write_packs(packs)
+        if all(bot.logit_cache is not None for bot in self.bot_list):
+            return self.cached_pack_probs(packs)
+        return self.keras_model.predict(self.model_input)
+
+    def cached_pack_probs(self, packs):
+        """
+        Looks up the unmasked logits of every bot in its LogitCache, the
+        misses are computed with a single model call. Bots with the same pool
+        (e.g. every bot at P1p1) and cache share one lookup and one model row,
+        so the cache counters are per distinct pool.
+        """
+        pool_bots = OrderedDict()
+        for bot_idx, bot in enumerate(self.bot_list):
+            key = (id(bot.logit_cache), LogitCache.key(bot.picks))
+            pool_bots.setdefault(key, []).append(bot_idx)
+        logits = [None] * len(self.bot_list)
+        missing = []
+        for bot_idxs in pool_bots.values():
+            bot = self.bot_list[bot_idxs[0]]
+            out = bot.logit_cache.get(bot.picks)
+            if out is None:
+                missing.append(bot_idxs)
+            for bot_idx in bot_idxs:
+                logits[bot_idx] = out
+        if missing:
+            pools = np.stack([self.bot_list[bot_idxs[0]].picks for bot_idxs in missing])
+            new_logits = pool_logits(self.keras_model, pools)
+            for bot_idxs, out in zip(missing, new_logits):
+                bot = self.bot_list[bot_idxs[0]]
+                bot.logit_cache.put(bot.picks, out)
+                for bot_idx in bot_idxs:
+                    logits[bot_idx] = out
+        return np.stack(logits) * self.pack_vecs
+
+    def pick_and_add(self, packs):
+        """
+        packs is a list with one pack per bot, returns the list of out packs
+        and the list of picked card indices (in the same order as the bots)
+        """
+        out = self.pack_probs(packs)
+        if self.batch_gumbel():
+            picks = self.gumbel_picks(out, packs)
+        else:
+            picks = [
+                bot.pick_from_probs(bot_out, pack)
+                for bot, pack, bot_out in zip(self.bot_list, packs, out)
+            ]
+        out_packs = []
+        card_idxs = []
+        for bot, pack, card_idx in zip(self.bot_list, packs, picks):
+            out_pack, card_idx = bot.add_pick(pack, card_idx)
+            out_packs.append(out_pack)
+            card_idxs.append(card_idx)
+        return out_packs, card_idxs
+
+    def batch_gumbel(self):
+        """
+        True if every bot samples with "gumbel" and the same top_k, the picks
+        of all the bots are then drawn at once
+        """
+        return all(
+            bot.pick_mode == "gumbel" and bot.top_k == self.bot_list[0].top_k
+            for bot in self.bot_list
+        )
+
+    def gumbel_picks(self, out, packs):
+        self.write_packs(packs)
+        pack_mask = self.pack_vecs > 0
+        temperature = np.asarray([[bot.temperature] for bot in self.bot_list])
+        return gumbel_max_sample(
+            out,
+            pack_mask,
+            temperature=temperature,
+            top_k=self.bot_list[0].top_k,
+            rng=self.bot_list[0].rng,
+        )
+
+    def pass_packs(self, packs, direction):
+        """
+        Bot at bot_idx passes its pack to bot (bot_idx + direction)
+        """
+        num_bots = len(self.bot_list)
+        new_packs = [None for _ in range(num_bots)]
+        for bot_idx, pack in enumerate(packs):
+            new_packs[(bot_idx + direction) % num_bots] = pack
+        return new_packs
@@ -0,0 +1,143 @@
+import numpy as np
+
+
+class NumpyModel(object):
+    precisions = ("float32", "float16", "int8")
+
+    def __init__(
+        self, kernels, biases, relus, set_size, precision="float32", kernel_scales=None
+    ):
+        """
+        Pure NumPy forward pass of a model built by nn_utils.build_model, with
+        the BatchNormalization layers already folded into the Dense weights
+        (see fold_keras_model).
+
+        Can be used in place of the keras model in NNBot, TablePicker and
+        DraftSimulator, only predict is implemented.
+
+        precision is how the kernels are stored in the npz: "float32",
+        "float16" or "int8" (symmetric, with one scale per layer). It only
+        makes the npz smaller: kernels are kept in memory as float32 (rounded
+        to precision), the forward pass runs in float32 since NumPy has no
+        fast float16/int8 matmul, and save quantizes them again.
+        If kernel_scales is given, kernels are already stored in precision
+        (as loaded from a npz), otherwise they are quantized here.
+        """
+        if precision not in self.precisions:
+            raise ValueError("Unknown precision: {}".format(precision))
+        self.precision = precision
+        self.biases = [np.asarray(bias, dtype=np.float32) for bias in biases]
+        self.relus = [bool(relu) for relu in relus]
+        self.set_size = int(set_size)
+        if kernel_scales is None:
+            quantized = [self._quantize_kernel(kernel, precision) for kernel in kernels]
+            kernels = [kernel for kernel, _ in quantized]
+            kernel_scales = [scale for _, scale in quantized]
+        self.kernel_scales = [float(scale) for scale in kernel_scales]
+        self.kernels = [
+            self._dequantize_kernel(kernel, scale)
+            for kernel, scale in zip(kernels, self.kernel_scales)
+        ]
+
+    @staticmethod
+    def _quantize_kernel(kernel, precision):
+        kernel = np.asarray(kernel, dtype=np.float32)
+        if precision == "int8":
+            max_abs = np.max(np.abs(kernel))
+            scale = max_abs / 127 if max_abs > 0 else 1.0
+            kernel = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+            return kernel, float(scale)
+        return kernel.astype(precision), 1.0
+
+    @staticmethod
+    def _dequantize_kernel(kernel, scale):
+        kernel = np.asarray(kernel)
+        if kernel.dtype == np.int8:
+            return kernel.astype(np.float32) * np.float32(scale)
+        return kernel.astype(np.float32)
+
+    def stored_kernel(self, idx):
+        """
+        Kernel of layer idx as stored in the npz
+        """
+        if self.precision == "int8":
+            kernel = np.round(self.kernels[idx] / np.float32(self.kernel_scales[idx]))
+            return np.clip(kernel, -127, 127).astype(np.int8)
+        return self.kernels[idx].astype(self.precision)
+
+    def quantize(self, precision):
+        """
+        Returns a copy of the model with kernels stored in precision
+        """
+        return NumpyModel(
+            self.kernels, self.biases, self.relus, self.set_size, precision=precision
+        )
+
+    @classmethod
+    def load(cls, npz_path):
+        npz = np.load(npz_path)
+        num_layers = len(npz["relus"])
+        kernels = [npz["kernel_{}".format(idx)] for idx in range(num_layers)]
+        biases = [npz["bias_{}".format(idx)] for idx in range(num_layers)]
+        if "precision" in npz:
+            precision = str(npz["precision"])
+            kernel_scales = npz["kernel_scales"]
+        else:
+            precision = "float32"
+            kernel_scales = np.ones(num_layers)
+        return cls(
+            kernels,
+            biases,
+            npz["relus"],
+            npz["set_size"],
+            precision=precision,
+            kernel_scales=kernel_scales,
+        )
+
+    def save(self, npz_path):
+        arrays = {}
+        for idx, bias in enumerate(self.biases):
+            arrays["kernel_{}".format(idx)] = self.stored_kernel(idx)
+            arrays["bias_{}".format(idx)] = bias
+        np.savez(
+            npz_path,
+            relus=np.asarray(self.relus),
+            set_size=np.asarray(self.set_size),
+            precision=np.asarray(self.precision),
+            kernel_scales=np.asarray(self.kernel_scales, dtype=np.float32),
+            **arrays
+        )
+
+    def logits(self, pools):
+        """
+        Unmasked logits for (batch, set_size) pool vectors
+        """
+        x = pools
+        for idx, (bias, relu) in enumerate(zip(self.biases, self.relus)):
+            x = x @ self.kernels[idx] + bias
+            if relu:
+                np.maximum(x, 0, out=x)
+        return x
+
+    def predict(self, model_input, batch_size=None, verbose=0):
+        model_input = np.asarray(model_input, dtype=np.float32)
+        if batch_size is None:
+            batch_size = len(model_input)
+        out = np.empty((len(model_input), self.set_size), dtype=np.float32)
+        for start in range(0, len(model_input), max(batch_size, 1)):
+            batch = model_input[start : start + batch_size]
+            out[start : start + batch_size] = (
+                self.logits(batch[:, : self.set_size]) * batch[:, self.set_size :]
+            )
+        return out
+
+
+def pick_agreement(model, reference_model, model_input, batch_size=1024):
+    """
+    Fraction of rows of model_input where model and reference_model have the
+    same argmax pick
+    """
+    out = model.predict(model_input, batch_size=batch_size)
+    reference_out = reference_model.predict(model_input, batch_size=batch_size)
+    return np.mean(np.argmax(out, axis=1) == np.argmax(reference_out, axis=1))
+
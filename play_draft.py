@@ -3,8 +3,7 @@ from PIL import Image, ImageTk, ImageOps
 from set_utils import available_sets, set_metadata_map, images_path
 from os.path import join as pjoin
 from tkinter.filedialog import askopenfilename
-import keras
-from nn_utils import NNBot
+from nn_utils import NNBot, TablePicker, LogitCache, load_model
 import numpy as np
 from functools import partial
 import argparse
@@ -104,7 +103,13 @@ class MainApplication(tk.Frame):
         self.apply_options()
 
     def load_model(self):
-        self.model = keras.models.load_model(self.model_path)
+        # the model and its logit cache are kept across drafts, until another
+        # model is chosen
+        if getattr(self, "loaded_model_path", None) == self.model_path:
+            return
+        self.model = load_model(self.model_path)
+        self.logit_cache = LogitCache()
+        self.loaded_model_path = self.model_path
 
     def apply_options(self):
         blank_image = Image.open(self.blank_image_path)
@@ -217,9 +222,13 @@ class MainApplication(tk.Frame):
         self.bot_list = []
         for _ in range(self.num_bots):
             nnbot = NNBot(
-                keras_model=self.model, set_size=self.set_size, pick_mode="max"
+                keras_model=self.model,
+                set_size=self.set_size,
+                pick_mode="max",
+                logit_cache=self.logit_cache,
             )
             self.bot_list.append(nnbot)
+        self.bot_table = TablePicker(self.bot_list)
 
         self.reset_picks()
 
@@ -267,14 +276,9 @@ class MainApplication(tk.Frame):
 
         # bot picks
         # TODO: track bot picks
-        bot_picks = []
         self.new_bot_packs = [[] for _ in range(self.num_bots)]
-        for bot_idx, nnbot in enumerate(self.bot_list):
-            pack = self.bot_packs[bot_idx]
-            out_pack, card_idx = nnbot.pick_and_add(pack)
-
-            bot_picks.append(card_idx)
-
+        out_packs, bot_picks = self.bot_table.pick_and_add(self.bot_packs)
+        for bot_idx, out_pack in enumerate(out_packs):
             out_bot_idx = bot_idx + self.pass_dir_val
             if out_bot_idx == -1 or out_bot_idx == self.num_bots:
                 self.new_player_pack = out_pack
@@ -499,8 +503,8 @@ class newDraftWindow(tk.Frame):
     def choose_model(self):
         model_path = askopenfilename(
             initialdir="/",
-            title="keras model hdf5 file",
-            filetypes=(("hdf5", "*.hdf5"), ("all files", "*.*")),
+            title="model file (keras hdf5 or exported npz)",
+            filetypes=(("hdf5", "*.hdf5"), ("npz", "*.npz"), ("all files", "*.*")),
         )
         self.mainApp.model_path = model_path
         self.return_to()
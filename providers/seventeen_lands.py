@@ -1,10 +1,105 @@
 import pandas as pd
 import numpy as np
+import glob
+import hashlib
+import io
+import mmap
+import multiprocessing
+import json
+import os
+import re
+import resource
+from utils import dense_to_csr, take_csr, BaseDataProcessor
 
-def parse_data_csv(csv_path):
+#columns the rows are grouped into drafts by, for storage='draft'
+draft_cols = ['draft_id','pack_number','pick_number']
 
+def parse_data_csv(csv_path,storage='dense',workers=1,engine='auto'):
+    """
+    storage='dense' returns data as a (rows,2*set_size) uint8 array of
+    [pool counts, pack flags] and target as the one-hot (rows,set_size) picks.
+    storage='csr' returns data as a dict of the CSR 'indptr','indices','data'
+    arrays of the same rows, and target as the (rows,) picked card indices.
+    storage='packed' is the same, except that the CSR arrays only hold the
+    pool half and the pack flags are np.packbits rows in data['pack_bits'].
+    storage='draft' groups the rows by draft_id, see csr_to_drafts: data
+    holds the draft tensor of the complete drafts in data['drafts'] and the
+    CSR arrays of the rows of the other drafts, target their picks.
+    With workers > 1, the csv is split into newline aligned byte ranges that
+    are parsed in parallel, see _parse_data_csv_parallel.
+    engine is the csv parser, see get_csv_engine.
+    """
+    if storage not in ('dense','csr','packed','draft'):
+        raise ValueError('Unknown storage: {}'.format(storage))
+
+    pack_cols,pool_cols,pack_names_no_prefix,_ = read_csv_columns(csv_path)
+    card_name_df = pd.DataFrame.from_records([{'Name':x} for x in pack_names_no_prefix])
+    extra_cols = draft_cols if storage == 'draft' else ()
+    if workers > 1:
+        data,target = _parse_data_csv_parallel(csv_path,storage,workers,pack_cols,
+                                               pool_cols,pack_names_no_prefix,engine)
+    elif storage == 'dense':
+        data,target = _chunks_to_dense(read_csv_chunks(csv_path,pack_cols,pool_cols,
+                                                       pack_names_no_prefix,engine=engine),
+                                       count_csv_rows(csv_path),pack_cols,pool_cols)
+    else:
+        chunks = read_csv_chunks(csv_path,pack_cols,pool_cols,pack_names_no_prefix,
+                                 extra_cols=extra_cols,engine=engine)
+        data,target = _chunks_to_csr(chunks,pack_cols,pool_cols,
+                                     pack_bits=storage == 'packed',extra_cols=extra_cols)
+    if storage == 'draft':
+        data,target = csr_to_drafts(data,target,len(pack_cols))
+    return data,target,card_name_df
+
+
+def _chunks_to_dense(chunks,num_rows,pack_cols,pool_cols):
+    #the output arrays are allocated once, from a row count, and each chunk is
+    #written in place
+    set_size = len(pack_cols)
+    data = np.zeros((num_rows,2*set_size),dtype=np.uint8)
+    target = np.zeros((num_rows,set_size),dtype=np.uint8)
+    row = 0
+    for data_df in chunks:
+        num_chunk_rows = len(data_df)
+        if row + num_chunk_rows > num_rows:
+            #only if the row count was off, grow by doubling
+            num_rows = max(2*num_rows,row + num_chunk_rows)
+            data = _grow_rows(data,num_rows)
+            target = _grow_rows(target,num_rows)
+        _write_dense_chunk(data_df,data,target,row,pack_cols,pool_cols)
+        row += num_chunk_rows
+    return data[:row],target[:row]
+
+
+def count_csv_rows(csv_path):
+    """
+    Number of data rows (lines after the header) of a csv, counted on the raw
+    bytes. Over-counts if the csv has blank lines or quoted newlines.
+    """
+    num_lines = _count_range_rows((csv_path,0,os.path.getsize(csv_path)))
+    return max(num_lines - 1,0)
+
+
+def _grow_rows(array,num_rows):
+    out = np.zeros((num_rows,) + array.shape[1:],dtype=array.dtype)
+    out[:len(array)] = array
+    return out
+
+
+def read_csv_columns(csv_path):
+    """
+    pack_card_ and pool_ column names, card names and card name -> index map
+    of a 17lands draft csv
+    """
     init_df = pd.read_csv(csv_path,nrows=1)
-    col_names = init_df.columns
+    return card_columns(init_df.columns)
+
+
+def card_columns(col_names):
+    """
+    pack_card_ and pool_ column names, card names and card name -> index map
+    from the column names of a 17lands draft dump
+    """
     pack_cols = [ name
                     for name in col_names
                     if name.startswith('pack_card_')]
@@ -22,35 +117,618 @@ def parse_data_csv(csv_path):
         assert pack_name == pool_name
 
     inv_map = {name:idx for idx,name in enumerate(pack_names_no_prefix)}
+    return pack_cols,pool_cols,pack_names_no_prefix,inv_map
 
 
-    picked_names = []
-    pack_tensor = None
-    pool_tensor = None
-    for data_df in pd.read_csv(csv_path, chunksize=10000):
-        if pack_tensor is None:
-            pack_tensor = data_df[pack_cols].values.astype(np.uint8)
-        else:
-            pack_tensor = np.vstack([pack_tensor,
-                                    data_df[pack_cols].values.astype(np.uint8)])
-        if pool_tensor is None:
-            pool_tensor = data_df[pool_cols].values.astype(np.uint8)
+def get_csv_engine(engine='auto'):
+    """
+    csv parser for engine: 'pyarrow', 'c' (pandas) or 'auto', pyarrow when
+    it is installed
+    """
+    if engine not in ('auto','c','pyarrow'):
+        raise ValueError('Unknown csv engine: {}'.format(engine))
+    if engine != 'auto':
+        return engine
+    try:
+        import pyarrow.csv
+        return 'pyarrow'
+    except ImportError:
+        return 'c'
+
+
+def read_csv_chunks(source,pack_cols,pool_cols,card_names,extra_cols=(),
+                    names=None,chunksize=10000,engine='auto'):
+    """
+    Iterator over the chunks of a draft csv, as DataFrames of only the pick,
+    pack_card_*, pool_* and extra_cols columns. The card columns are read as
+    uint8 and pick as a categorical of card_names (see pick_indices).
+    source is a path or a file object, names the column names if it has no
+    header (see read_csv_range).
+    With the pyarrow engine (see get_csv_engine), chunks hold about chunksize
+    rows instead of exactly chunksize.
+    """
+    usecols = ['pick'] + list(pack_cols) + list(pool_cols) + list(extra_cols)
+    card_cols = list(pack_cols) + list(pool_cols)
+    if get_csv_engine(engine) == 'pyarrow':
+        return _read_csv_chunks_pyarrow(source,usecols,card_cols,card_names,names,
+                                        chunksize)
+    dtype = {col:np.uint8 for col in card_cols}
+    dtype['pick'] = pd.CategoricalDtype(card_names)
+    if names is None:
+        return pd.read_csv(source,usecols=usecols,dtype=dtype,chunksize=chunksize)
+    return pd.read_csv(source,header=None,names=names,usecols=usecols,dtype=dtype,
+                       chunksize=chunksize)
+
+
+def _read_csv_chunks_pyarrow(source,usecols,card_cols,card_names,names,chunksize):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    #block_size is in bytes, about 2 characters per column of a row
+    num_columns = len(names) if names is not None else len(usecols)
+    read_options = pa_csv.ReadOptions(
+        column_names=list(names) if names is not None else None,
+        block_size=max(chunksize*2*num_columns,2**20))
+    column_types = {col:pa.uint8() for col in card_cols}
+    column_types['pick'] = pa.dictionary(pa.int32(),pa.string())
+    convert_options = pa_csv.ConvertOptions(include_columns=usecols,
+                                            column_types=column_types)
+    reader = pa_csv.open_csv(source,read_options=read_options,
+                             convert_options=convert_options)
+    for batch in reader:
+        data_df = batch.to_pandas()
+        data_df['pick'] = pd.Categorical(data_df['pick'],categories=card_names)
+        yield data_df
+
+
+def pick_indices(data_df):
+    """
+    int16 card indices of the picks of a chunk from read_csv_chunks, the
+    codes of its categorical pick column
+    """
+    codes = data_df['pick'].cat.codes.values
+    if len(codes) and codes.min() < 0:
+        raise ValueError('picked card not in the pack_card_ columns')
+    return codes.astype(np.int16)
+
+
+def _write_dense_chunk(data_df,data,target,row,pack_cols,pool_cols):
+    num_rows = len(data_df)
+    set_size = len(pack_cols)
+    data[row:row + num_rows,:set_size] = data_df[pool_cols].values
+    data[row:row + num_rows,set_size:] = data_df[pack_cols].values
+    target[row + np.arange(num_rows),pick_indices(data_df)] = 1
+
+
+def _chunk_to_dense(data_df,pack_cols,pool_cols):
+    """[pool counts, pack flags] uint8 rows and int16 picks of a csv chunk
+    """
+    x = np.concatenate([data_df[pool_cols].values,data_df[pack_cols].values],axis=1)
+    return x,pick_indices(data_df)
+
+
+def is_test_draft(draft_ids,test_fraction):
+    """
+    Train/test assignment of rows by a hash of their draft_id, so that all
+    the picks of a draft are on the same side, in every pass over the csv
+    """
+    hashes = pd.util.hash_pandas_object(pd.Series(draft_ids),index=False).values
+    return (hashes % 10000) < int(test_fraction*10000)
+
+
+def count_split_rows(csv_path,test_fraction,chunksize=10000,engine='auto'):
+    """
+    Number of train and test rows of a draft csv (see is_test_draft), in a
+    single pass over its draft_id column
+    """
+    counts = {'train':0,'test':0}
+    if get_csv_engine(engine) == 'pyarrow':
+        import pyarrow.csv as pa_csv
+        reader = pa_csv.open_csv(csv_path,
+                                 read_options=pa_csv.ReadOptions(block_size=max(chunksize*64,2**20)),
+                                 convert_options=pa_csv.ConvertOptions(include_columns=['draft_id']))
+        chunks = (batch.to_pandas() for batch in reader)
+    else:
+        chunks = pd.read_csv(csv_path,usecols=['draft_id'],chunksize=chunksize*10)
+    for data_df in chunks:
+        num_test = int(np.sum(is_test_draft(data_df['draft_id'].values,test_fraction)))
+        counts['test'] += num_test
+        counts['train'] += len(data_df) - num_test
+    return counts
+
+
+class CSVStreamProcessor(BaseDataProcessor):
+    def __init__(self,csv_path,split='train',test_fraction=0.2,
+                 max_memory_mb=512,chunksize=10000,engine='auto',split_counts=None):
+        """
+        Streams the rows of a 17lands draft csv, without ever holding the
+        whole dataset in memory. Rows are read chunksize at a time and split
+        into train/test by a hash of the draft_id (see is_test_draft), split
+        is 'train' or 'test'.
+        When shuffling, rows go through a shuffle buffer of max_memory_mb
+        (the csv chunk being parsed comes on top of that).
+        Has the get_batch_iter interface of the utils processors, so it can be
+        fed to train_utils.make_batch_dataset.
+        engine is the csv parser, see get_csv_engine.
+        split_counts is a dict filled with the row counts of both splits the
+        first time len is called, pass the same dict to the train and test
+        processors of a csv to count them once (see open_csv_splits).
+        """
+        if split not in ('train','test'):
+            raise ValueError('Unknown split: {}'.format(split))
+        self.csv_path = csv_path
+        self.split = split
+        self.test_fraction = test_fraction
+        self.chunksize = chunksize
+        self.engine = engine
+        (self.pack_cols,self.pool_cols,
+         self.card_names,_) = read_csv_columns(csv_path)
+        self.num_cards_in_set = len(self.card_names)
+        row_bytes = 2*self.num_cards_in_set + np.dtype(np.int16).itemsize
+        self.buffer_rows = max(int(max_memory_mb*2**20) // row_bytes,1)
+        self.buffer_bytes = self.buffer_rows*row_bytes
+        self.split_counts = split_counts if split_counts is not None else {}
+
+    def read_chunks(self,worker_idx=0,num_workers=1):
+        """
+        Yields the (x, pick) rows of this split, chunk by chunk. The csv is
+        split into num_workers byte ranges (see split_byte_ranges), worker
+        worker_idx only reads range worker_idx.
+        """
+        byte_ranges = split_byte_ranges(self.csv_path,num_workers)
+        if worker_idx >= len(byte_ranges):
+            return
+        start,stop = byte_ranges[worker_idx]
+        for data_df in read_csv_range(self.csv_path,start,stop,self.pack_cols,
+                                      self.pool_cols,self.card_names,
+                                      extra_cols=['draft_id'],chunksize=self.chunksize,
+                                      engine=self.engine):
+            is_test = is_test_draft(data_df['draft_id'].values,self.test_fraction)
+            data_df = data_df[is_test == (self.split == 'test')]
+            if len(data_df):
+                yield _chunk_to_dense(data_df,self.pack_cols,self.pool_cols)
+
+    def get_num_workers(self,batch_size,num_workers):
+        """
+        Small csvs have fewer byte ranges than num_workers
+        """
+        return max(min(num_workers,len(split_byte_ranges(self.csv_path,num_workers))),1)
+
+    def shuffled_rows(self,rng,worker_idx=0,num_workers=1):
+        """
+        Yields the rows of one pass over the csv, shuffled through the bounded
+        buffer: once the buffer is full, each incoming row replaces a random
+        buffered row, which is emitted.
+        """
+        buffer_x = np.zeros((self.buffer_rows,2*self.num_cards_in_set),dtype=np.uint8)
+        buffer_pick = np.zeros(self.buffer_rows,dtype=np.int16)
+        num_buffered = 0
+        for x,pick in self.read_chunks(worker_idx,num_workers):
+            start = 0
+            while start < len(x):
+                #fill the free space first
+                num_fill = min(self.buffer_rows - num_buffered,len(x) - start)
+                buffer_x[num_buffered:num_buffered + num_fill] = x[start:start + num_fill]
+                buffer_pick[num_buffered:num_buffered + num_fill] = pick[start:start + num_fill]
+                num_buffered += num_fill
+                start += num_fill
+
+                num_swap = min(self.buffer_rows,len(x) - start)
+                if num_swap:
+                    slots = rng.choice(self.buffer_rows,size=num_swap,replace=False)
+                    yield buffer_x[slots],buffer_pick[slots]
+                    buffer_x[slots] = x[start:start + num_swap]
+                    buffer_pick[slots] = pick[start:start + num_swap]
+                    start += num_swap
+
+        order = rng.permutation(num_buffered)
+        yield buffer_x[order],buffer_pick[order]
+
+    def get_batch_iter(self,batch_size,shuffle=True,worker_idx=0,
+                       num_workers=1,seed=None,start_batch=0):
+        """
+        Yields (x, y) batches forever, one pass over the csv per epoch.
+        The first start_batch batches are skipped, they still have to be read
+        from the csv, but aren't yielded.
+        If a pass has no rows of the split, the worker stops (the other
+        workers' batches are still interleaved), a single worker raises.
+        """
+        for batch_idx,batch in enumerate(self._batch_iter(batch_size,shuffle,
+                                                          worker_idx,num_workers,
+                                                          seed)):
+            if batch_idx >= start_batch:
+                yield batch
+
+    def _batch_iter(self,batch_size,shuffle,worker_idx,num_workers,seed):
+        rng = np.random.default_rng(seed)
+        while True:
+            if shuffle:
+                rows = self.shuffled_rows(rng,worker_idx,num_workers)
+            else:
+                rows = self.read_chunks(worker_idx,num_workers)
+            pending_x = []
+            pending_pick = []
+            num_pending = 0
+            num_rows = 0
+            for x,pick in rows:
+                num_rows += len(x)
+                pending_x.append(x)
+                pending_pick.append(pick)
+                num_pending += len(x)
+                if num_pending < batch_size:
+                    continue
+                x = np.concatenate(pending_x)
+                pick = np.concatenate(pending_pick)
+                num_full = (len(x) // batch_size)*batch_size
+                for start in range(0,num_full,batch_size):
+                    yield self.make_batch(x[start:start + batch_size],
+                                          pick[start:start + batch_size])
+                pending_x = [x[num_full:]]
+                pending_pick = [pick[num_full:]]
+                num_pending = len(x) - num_full
+            if num_pending:
+                yield self.make_batch(np.concatenate(pending_x),
+                                      np.concatenate(pending_pick))
+            if num_rows == 0:
+                if num_workers == 1:
+                    raise ValueError('No {} rows in {}'.format(self.split,self.csv_path))
+                return
+
+    def make_batch(self,x,pick):
+        y = np.zeros((len(x),self.num_cards_in_set),dtype=np.uint8)
+        y[np.arange(len(x)),pick] = 1
+        return x,y
+
+    def __len__(self):
+        """
+        Number of rows in this split, see count_split_rows
+        """
+        if not self.split_counts:
+            self.split_counts.update(count_split_rows(self.csv_path,self.test_fraction,
+                                                      chunksize=self.chunksize,
+                                                      engine=self.engine))
+        return self.split_counts[self.split]
+
+    def memory_report(self):
+        """
+        Configured shuffle buffer size and peak resident memory of the process
+        so far, in MB
+        """
+        #ru_maxrss is in kilobytes on linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+        return 'shuffle buffer: {:.1f} MB ({} rows), peak RSS: {:.1f} MB'.format(
+            self.buffer_bytes/2**20,self.buffer_rows,peak_rss)
+
+
+def open_csv_splits(csv_path,test_fraction=0.2,max_memory_mb=512,chunksize=10000,
+                    engine='auto'):
+    """
+    Train and test CSVStreamProcessors of a draft csv, sharing one count of
+    their rows
+    """
+    split_counts = {}
+    return tuple(CSVStreamProcessor(csv_path,split=split,test_fraction=test_fraction,
+                                    max_memory_mb=max_memory_mb,chunksize=chunksize,
+                                    engine=engine,split_counts=split_counts)
+                 for split in ('train','test'))
+
+
+def _chunks_to_csr(chunks,pack_cols,pool_cols,pack_bits=False,extra_cols=()):
+    #each chunk is converted to CSR right away, the dense rows are never
+    #accumulated. The extra_cols values are returned in data too.
+    extra_values = {col:[] for col in extra_cols}
+    indptrs = []
+    indices = []
+    values = []
+    picks = []
+    packed_packs = []
+    num_nonzero = 0
+    for data_df in chunks:
+        chunk = data_df[pool_cols].values
+        pack_chunk = data_df[pack_cols].values
+        if pack_bits:
+            packed_packs.append(np.packbits(pack_chunk,axis=1))
         else:
-            pool_tensor = np.vstack([pool_tensor,
-                                    data_df[pool_cols].values.astype(np.uint8)])
-        picked_names.extend(data_df['pick'])
+            chunk = np.concatenate([chunk,pack_chunk],axis=1)
+        chunk_indptr,chunk_indices,chunk_values = dense_to_csr(chunk)
+        indptrs.append(chunk_indptr[1:] + num_nonzero)
+        indices.append(chunk_indices)
+        values.append(chunk_values)
+        num_nonzero += chunk_indptr[-1]
+        picks.append(pick_indices(data_df))
+        for col in extra_cols:
+            extra_values[col].append(data_df[col].values)
 
+    data = {'indptr':np.concatenate([np.zeros(1,dtype=np.int64)] + indptrs),
+            'indices':np.concatenate(indices),
+            'data':np.concatenate(values)}
+    if pack_bits:
+        data['pack_bits'] = np.concatenate(packed_packs)
+    for col in extra_cols:
+        data[col] = np.concatenate(extra_values[col])
+    target = np.concatenate(picks)
+    return data,target
 
-    data = np.concatenate([pool_tensor,pack_tensor],axis=1)
-    
-    
-    target = np.zeros_like(pack_tensor,dtype=np.uint8)
-    for n,name in enumerate(picked_names):
-        card_idx = inv_map[name]
-        target[n,card_idx] = 1
 
-    card_name_df = pd.DataFrame.from_records([{'Name':x} for x in pack_names_no_prefix])
-    return data,target,card_name_df
+def csr_to_drafts(data,target,set_size,num_packs=3):
+    """
+    Groups the CSR rows of _chunks_to_csr (with the draft_cols extra_cols)
+    by draft_id into an int16 (drafts,num_packs*pack_size,pack_size) draft
+    tensor, see DraftFormatProcessor: row pick has the picked card first,
+    then the rest of the pack, 0 padded. pack_size is the most common number
+    of cards of the first picks' packs.
+    The draft tensor only rebuilds the pools from the picks, so a draft is
+    only converted if every pick is there once, with a pack of
+    pack_size - pick_number cards that has the picked card, and a pool of
+    the draft's earlier picks (compared by a 64 bit linear hash). The rows
+    of the other drafts are kept as CSR rows, with their pack counts clipped
+    to 1: the draft tensor only has pack flags, so a pack's duplicate cards
+    are flags of 1 in the whole dataset (as in the 'packed' storage).
+    Returns the CSR arrays of the other drafts' rows with 'drafts', the draft
+    tensor, and their picks.
+    """
+    indptr,indices,values = data['indptr'],data['indices'],data['data']
+    num_rows = len(target)
+    target = np.asarray(target,dtype=np.int64)
+    #missing numbers become -1, which fails the checks below
+    pack_number = pd.Series(data['pack_number']).fillna(-1).to_numpy(np.int64)
+    pick_number = pd.Series(data['pick_number']).fillna(-1).to_numpy(np.int64)
+    row_lengths = np.diff(indptr)
+    entry_rows = np.repeat(np.arange(num_rows),row_lengths)
+    is_pack = indices >= set_size
+
+    pack_counts = np.bincount(entry_rows[is_pack],weights=values[is_pack],
+                              minlength=num_rows).astype(np.int64)
+    first_pack_counts = pack_counts[pick_number == 0]
+    if len(first_pack_counts):
+        pack_size = int(np.bincount(first_pack_counts).argmax())
+    else:
+        pack_size = int(pick_number.max()) + 1 if num_rows else 1
+    draft_size = num_packs*pack_size
+    has_pick = np.bincount(entry_rows[indices == set_size + target[entry_rows]],
+                           minlength=num_rows) > 0
+    #pool hash of each row, from the cumulative sums of the entry hashes
+    card_hashes = np.random.default_rng(0).integers(2**63,size=set_size,dtype=np.uint64)
+    entry_hashes = np.where(is_pack,np.uint64(0),
+                            values.astype(np.uint64)*card_hashes[indices % set_size])
+    cum_hashes = np.concatenate([np.zeros(1,dtype=np.uint64),np.cumsum(entry_hashes)])
+    pool_hashes = cum_hashes[indptr[1:]] - cum_hashes[indptr[:-1]]
+    row_ok = ((pick_number < pack_size) & (pack_number < num_packs) & has_pick
+              & (pack_counts == pack_size - pick_number) & pd.notna(data['draft_id']))
+
+    #sorted by draft, then pick, each draft should be its picks in order
+    #the missing draft_ids (code -1) get a code of their own, their rows aren't ok anyway
+    draft_codes,draft_ids = pd.factorize(data['draft_id'])
+    draft_codes = np.where(draft_codes < 0,len(draft_ids),draft_codes)
+    order = np.lexsort((pick_number,pack_number,draft_codes))
+    sorted_codes = draft_codes[order]
+    draft_starts = np.flatnonzero(np.diff(sorted_codes,prepend=-1))
+    draft_lengths = np.diff(np.concatenate([draft_starts,[num_rows]]))
+    row_draft_starts = np.repeat(draft_starts,draft_lengths)
+    pick_hashes = np.cumsum(card_hashes[target[order]])
+    pick_hashes -= card_hashes[target[order]]
+    sorted_ok = (row_ok[order]
+                 & (np.arange(num_rows) - row_draft_starts
+                    == pack_number[order]*pack_size + pick_number[order])
+                 & (pool_hashes[order] == pick_hashes - pick_hashes[row_draft_starts]))
+    num_drafts = len(draft_starts)
+    draft_ok = ((draft_lengths == draft_size)
+                & (np.bincount(sorted_codes[~sorted_ok],minlength=num_drafts) == 0))
+    in_drafts = draft_ok[sorted_codes]
+
+    #pack cards of the complete drafts' rows, one entry per copy, without
+    #the picked card
+    draft_rows = order[in_drafts]
+    pack_dict = take_csr({'indptr':indptr,'indices':indices,'data':values},draft_rows)
+    pack_entries = pack_dict['indices'] >= set_size
+    entry_rows = np.repeat(np.arange(len(draft_rows)),np.diff(pack_dict['indptr']))[pack_entries]
+    copies = pack_dict['data'][pack_entries].astype(np.int64)
+    entry_rows = np.repeat(entry_rows,copies)
+    entry_cards = np.repeat(pack_dict['indices'][pack_entries].astype(np.int64) - set_size,copies)
+    picked_entries = np.flatnonzero(entry_cards == target[draft_rows][entry_rows])
+    _,first_picked = np.unique(entry_rows[picked_entries],return_index=True)
+    keep = np.ones(len(entry_rows),dtype=bool)
+    keep[picked_entries[first_picked]] = False
+    entry_rows = entry_rows[keep]
+    entry_cards = entry_cards[keep]
+    slots = 1 + np.arange(len(entry_rows)) - np.searchsorted(entry_rows,entry_rows)
+    drafts = np.zeros((len(draft_rows),pack_size),dtype=np.int16)
+    drafts[:,0] = target[draft_rows]
+    drafts[entry_rows,slots] = entry_cards
+
+    other_rows = np.sort(order[~in_drafts])
+    other_dict = take_csr({'indptr':indptr,'indices':indices,'data':values,
+                           'pick':target.astype(np.int16)},other_rows)
+    other_target = other_dict.pop('pick')
+    other_dict['data'] = np.where(other_dict['indices'] >= set_size,
+                                  np.minimum(other_dict['data'],1),
+                                  other_dict['data']).astype(values.dtype)
+    other_dict['drafts'] = drafts.reshape(-1,draft_size,pack_size)
+    return other_dict,other_target
+
+
+class ByteRangeFile(io.RawIOBase):
+    def __init__(self,path,start,stop):
+        """
+        Read only file object over bytes start:stop of path, so that
+        pd.read_csv can stream a part of a csv
+        """
+        self.file = open(path,'rb')
+        self.file.seek(start)
+        self.remaining = stop - start
+
+    def readable(self):
+        return True
+
+    def readinto(self,buffer):
+        num_bytes = self.file.readinto(memoryview(buffer)[:min(len(buffer),self.remaining)])
+        self.remaining -= num_bytes
+        return num_bytes
+
+    def close(self):
+        self.file.close()
+        super(ByteRangeFile,self).close()
+
+
+def split_byte_ranges(csv_path,num_ranges):
+    """
+    (start, stop) byte ranges covering the data rows of a csv (the header
+    excluded), split at newlines, at most num_ranges of them
+    """
+    size = os.path.getsize(csv_path)
+    with open(csv_path,'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        for range_idx in range(1,num_ranges):
+            #the range starts after the first newline at or after pos-1
+            pos = bounds[0] + (size - bounds[0])*range_idx//num_ranges
+            f.seek(max(pos - 1,bounds[-1]))
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return [(start,stop) for start,stop in zip(bounds[:-1],bounds[1:]) if stop > start]
+
+
+def read_csv_range(csv_path,start,stop,pack_cols,pool_cols,card_names,
+                   extra_cols=(),chunksize=10000,engine='auto'):
+    """
+    read_csv_chunks over the rows in bytes start:stop of csv_path (see
+    split_byte_ranges)
+    """
+    names = list(pd.read_csv(csv_path,nrows=0).columns)
+    return read_csv_chunks(io.BufferedReader(ByteRangeFile(csv_path,start,stop)),
+                           pack_cols,pool_cols,card_names,extra_cols=extra_cols,
+                           names=names,chunksize=chunksize,engine=engine)
+
+
+def _count_range_rows(byte_range,block_size=2**24):
+    csv_path,start,stop = byte_range
+    num_lines = 0
+    last_block = b'\n'
+    with io.BufferedReader(ByteRangeFile(csv_path,start,stop)) as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            num_lines += block.count(b'\n')
+            last_block = block
+    if not last_block.endswith(b'\n'):
+        num_lines += 1
+    return num_lines
+
+
+def _shared_zeros(shape,dtype):
+    """
+    Zeroed array in anonymous shared memory, written to by forked workers
+    """
+    num_bytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+    buffer = mmap.mmap(-1,max(num_bytes,1))
+    return np.frombuffer(buffer,dtype=dtype,count=int(np.prod(shape))).reshape(shape)
+
+
+#set by _parse_data_csv_parallel before forking the workers
+_ingest_state = {}
+
+
+def _parse_range_dense(range_args):
+    """
+    Parses a byte range and writes its rows straight into the shared output
+    arrays, at row_offset. Returns the number of rows parsed.
+    """
+    csv_path,start,stop,row_offset,num_rows = range_args
+    data = _ingest_state['data']
+    target = _ingest_state['target']
+    pack_cols = _ingest_state['pack_cols']
+    pool_cols = _ingest_state['pool_cols']
+    row = row_offset
+    for data_df in read_csv_range(csv_path,start,stop,pack_cols,pool_cols,
+                                  _ingest_state['card_names'],
+                                  engine=_ingest_state['engine']):
+        num_chunk_rows = len(data_df)
+        if row + num_chunk_rows > row_offset + num_rows:
+            raise ValueError('more rows than lines in bytes {}:{}'.format(start,stop))
+        _write_dense_chunk(data_df,data,target,row,pack_cols,pool_cols)
+        row += num_chunk_rows
+    return row - row_offset
+
+
+def _parse_range_csr(range_args):
+    csv_path,start,stop = range_args
+    pack_cols = _ingest_state['pack_cols']
+    pool_cols = _ingest_state['pool_cols']
+    extra_cols = _ingest_state['extra_cols']
+    return _chunks_to_csr(read_csv_range(csv_path,start,stop,pack_cols,pool_cols,
+                                         _ingest_state['card_names'],extra_cols=extra_cols,
+                                         engine=_ingest_state['engine']),
+                          pack_cols,pool_cols,
+                          pack_bits=_ingest_state['pack_bits'],extra_cols=extra_cols)
+
+
+def _parse_data_csv_parallel(csv_path,storage,workers,pack_cols,pool_cols,card_names,
+                             engine='auto'):
+    """
+    Splits the csv into newline aligned byte ranges (a few per worker) parsed
+    by a pool of forked workers.
+    For dense storage, the rows of each range are counted first, then each
+    worker writes its rows straight into output arrays in shared memory.
+    For csr/packed/draft storage, each worker returns the (small) CSR arrays
+    of its range, which are concatenated in order.
+    """
+    byte_ranges = split_byte_ranges(csv_path,4*workers)
+    _ingest_state.clear()
+    _ingest_state.update(pack_cols=pack_cols,pool_cols=pool_cols,card_names=card_names,
+                         engine=engine,
+                         pack_bits=storage == 'packed',
+                         extra_cols=draft_cols if storage == 'draft' else ())
+    #fork, the workers inherit _ingest_state and the shared output arrays
+    ctx = multiprocessing.get_context('fork')
+    if storage in ('csr','packed','draft'):
+        with ctx.Pool(workers) as pool:
+            blocks = pool.map(_parse_range_csr,
+                              [(csv_path,start,stop) for start,stop in byte_ranges])
+        _ingest_state.clear()
+        return _concatenate_csr(blocks)
+
+    with ctx.Pool(workers) as pool:
+        range_rows = pool.map(_count_range_rows,
+                              [(csv_path,start,stop) for start,stop in byte_ranges])
+    row_offsets = np.concatenate([[0],np.cumsum(range_rows)])
+    set_size = len(pack_cols)
+    data = _shared_zeros((row_offsets[-1],2*set_size),np.uint8)
+    target = _shared_zeros((row_offsets[-1],set_size),np.uint8)
+    _ingest_state.update(data=data,target=target)
+    with ctx.Pool(workers) as pool:
+        parsed_rows = pool.map(_parse_range_dense,
+                               [(csv_path,start,stop,row_offset,num_rows)
+                                for (start,stop),row_offset,num_rows
+                                in zip(byte_ranges,row_offsets,range_rows)])
+    _ingest_state.clear()
+
+    #blank lines are counted but not parsed, move the rows over the gaps
+    row = 0
+    for row_offset,num_rows in zip(row_offsets,parsed_rows):
+        if row != row_offset:
+            data[row:row + num_rows] = data[row_offset:row_offset + num_rows].copy()
+            target[row:row + num_rows] = target[row_offset:row_offset + num_rows].copy()
+        row += num_rows
+    return data[:row],target[:row]
+
+
+def _concatenate_csr(blocks):
+    """
+    Concatenates the rows of (data, target) CSR blocks from _chunks_to_csr
+    """
+    num_nonzero = np.cumsum([0] + [block['indptr'][-1] for block,_ in blocks])
+    data = {'indptr':np.concatenate([np.zeros(1,dtype=np.int64)] +
+                                    [block['indptr'][1:] + offset
+                                     for (block,_),offset in zip(blocks,num_nonzero)]),
+            'indices':np.concatenate([block['indices'] for block,_ in blocks]),
+            'data':np.concatenate([block['data'] for block,_ in blocks])}
+    for name in blocks[0][0]:
+        if name not in data:
+            data[name] = np.concatenate([block[name] for block,_ in blocks])
+    target = np.concatenate([target for _,target in blocks])
+    return data,target
 
 
 def create_set_csv_from_draft_csv(draft_csv_path,output_csv):
@@ -67,3 +745,180 @@ def create_set_csv_from_draft_csv(draft_csv_path,output_csv):
     out_df = pd.DataFrame.from_records(card_names)
     out_df.to_csv(output_csv,index=False)
 
+
+
+#rank order for the rank filters of the parquet cache
+rank_names = ['bronze','silver','gold','platinum','diamond','mythic']
+#types of the non card columns of the parquet cache, others are read as strings
+parquet_column_types = {
+    'pack_number':'int8',
+    'pick_number':'int8',
+    'event_match_wins':'int8',
+    'event_match_losses':'int8',
+    'pick_maindeck_rate':'float32',
+    'pick_sideboard_in_rate':'float32',
+    'user_n_games_bucket':'int32',
+    'user_game_win_rate_bucket':'float32',
+}
+parquet_partitioning = ['event_type','month']
+parquet_manifest_name = '_manifest.json'
+
+
+def build_parquet_cache(csv_path,cache_dir,chunksize=65536):
+    """
+    Adds a 17lands draft dump to a Parquet cache directory, partitioned (hive
+    style) by event_type and draft_time month, with chunksize row groups.
+    Card columns are stored as uint8, and rank as rank_level too (index in
+    rank_names, -1 if missing) so that rank filters are numeric.
+    Each dump is written as new files under its own basename (unique within
+    the cache), so adding a dump only appends files to the (new or existing)
+    partitions. The dumps already in the cache are listed in its manifest,
+    adding one again is a no-op. All the dumps of a cache must have the same cards (one cache per
+    set).
+    Returns False if the dump was already in the cache.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as pa_ds
+
+    manifest_path = os.path.join(cache_dir,parquet_manifest_name)
+    manifest = {'dumps':[]}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    dump_name = os.path.basename(csv_path)
+    dump_size = os.path.getsize(csv_path)
+    for dump in manifest['dumps']:
+        if dump['name'] == dump_name:
+            if dump['size'] != dump_size:
+                raise ValueError('a different {} is already in {}'.format(dump_name,cache_dir))
+            return False
+
+    col_names = list(pd.read_csv(csv_path,nrows=0).columns)
+    pack_cols,pool_cols,_,_ = card_columns(col_names)
+    column_types = {col:pa.uint8() for col in pack_cols + pool_cols}
+    for col in col_names:
+        if col not in column_types:
+            column_types[col] = pa.type_for_alias(parquet_column_types.get(col,'string'))
+    read_options = pa_csv.ReadOptions(block_size=max(chunksize*2*len(col_names),2**20))
+    reader = pa_csv.open_csv(csv_path,read_options=read_options,
+                             convert_options=pa_csv.ConvertOptions(column_types=column_types))
+
+    def add_partition_columns(batch):
+        month = pc.utf8_slice_codeunits(batch.column('draft_time'),0,7)
+        rank_level = pc.fill_null(pc.index_in(pc.utf8_lower(batch.column('rank')),
+                                              value_set=pa.array(rank_names)),-1)
+        return pa.RecordBatch.from_arrays(
+            batch.columns + [month,pc.cast(rank_level,pa.int8())],
+            names=batch.schema.names + ['month','rank_level'])
+
+    num_rows = 0
+    def batches():
+        nonlocal num_rows
+        for batch in reader:
+            num_rows += batch.num_rows
+            yield add_partition_columns(batch)
+    schema = reader.schema.append(pa.field('month',pa.string())).append(pa.field('rank_level',pa.int8()))
+
+    #the basename keeps the dump's files apart from the other dumps' ones: its
+    #index in the manifest and a hash of its name and size, the sanitized
+    #name is only there to be readable
+    name_hash = hashlib.sha1('{}:{}'.format(dump_name,dump_size).encode()).hexdigest()[:10]
+    dump_id = '{:04d}_{}_{}'.format(len(manifest['dumps']),name_hash,
+                                    re.sub(r'[^A-Za-z0-9_]','_',os.path.splitext(dump_name)[0]))
+    if glob.glob(os.path.join(glob.escape(cache_dir),'**',glob.escape(dump_id) + '-*.parquet'),
+                 recursive=True):
+        raise ValueError('{} already has {} files, not in its manifest (interrupted '
+                         'ingest?), delete them first'.format(cache_dir,dump_id))
+    pa_ds.write_dataset(batches(),cache_dir,schema=schema,
+                        format='parquet',partitioning=parquet_partitioning,
+                        partitioning_flavor='hive',
+                        basename_template=dump_id + '-{i}.parquet',
+                        existing_data_behavior='overwrite_or_ignore',
+                        max_rows_per_group=chunksize)
+
+    manifest['dumps'].append({'name':dump_name,'size':dump_size,'num_rows':num_rows,
+                              'basename':dump_id})
+    with open(manifest_path + '.tmp','w') as f:
+        json.dump(manifest,f,indent=2)
+    os.replace(manifest_path + '.tmp',manifest_path)
+    return True
+
+
+def parse_filter(filter_str):
+    """
+    pyarrow.dataset filter expression for 'column op value', op one of
+    ==, !=, >=, <=, >, <. rank is compared in rank_names order
+    ('rank>=gold'), rows without a known rank (rank_level -1) never pass a
+    rank filter, not even 'rank<gold' or 'rank!=mythic'. draft_time is compared as a string ('draft_time>=2021-05'),
+    and also prunes the month partitions.
+    """
+    import pyarrow.dataset as pa_ds
+
+    match = re.match(r'^\s*(\w+)\s*(==|!=|>=|<=|>|<)\s*(.+?)\s*$',filter_str)
+    if match is None:
+        raise ValueError('Invalid filter: {}'.format(filter_str))
+    column,op,value = match.groups()
+    if column == 'rank':
+        if value.lower() not in rank_names:
+            raise ValueError('Unknown rank: {}, should be one of {}'.format(value,rank_names))
+        column,value = 'rank_level',rank_names.index(value.lower())
+    elif parquet_column_types.get(column,'string').startswith('int'):
+        value = int(value)
+    elif parquet_column_types.get(column,'string').startswith('float'):
+        value = float(value)
+
+    def compare(field,value):
+        return {'==':field == value,'!=':field != value,'>=':field >= value,
+                '<=':field <= value,'>':field > value,'<':field < value}[op]
+
+    expression = compare(pa_ds.field(column),value)
+    if column == 'rank_level':
+        expression = expression & (pa_ds.field('rank_level') >= 0)
+    if column == 'draft_time' and op in ('>=','>','<=','<'):
+        month_op = {'>':'>=','<':'<='}.get(op,op)
+        month = pa_ds.field('month')
+        expression = expression & (month >= value[:7] if month_op == '>=' else month <= value[:7])
+    return expression
+
+
+def open_parquet_cache(cache_dir):
+    import pyarrow.dataset as pa_ds
+    return pa_ds.dataset(cache_dir,format='parquet',partitioning='hive')
+
+
+def parse_data_parquet(cache_dir,storage='dense',filters=(),chunksize=65536):
+    """
+    Same outputs as parse_data_csv, for the rows of a parquet cache (see
+    build_parquet_cache) that pass all of filters (see parse_filter). Only
+    the pick and card columns are read, and the filters are pushed down to
+    the partitions and row group statistics.
+    """
+    if storage not in ('dense','csr','packed','draft'):
+        raise ValueError('Unknown storage: {}'.format(storage))
+    dataset = open_parquet_cache(cache_dir)
+    pack_cols,pool_cols,card_names,_ = card_columns(dataset.schema.names)
+    card_name_df = pd.DataFrame.from_records([{'Name':x} for x in card_names])
+    expression = None
+    for filter_str in filters:
+        filter_expression = parse_filter(filter_str)
+        expression = filter_expression if expression is None else expression & filter_expression
+    extra_cols = draft_cols if storage == 'draft' else []
+
+    def chunks():
+        for batch in dataset.to_batches(columns=['pick'] + pack_cols + pool_cols + extra_cols,
+                                        filter=expression,batch_size=chunksize):
+            data_df = batch.to_pandas()
+            data_df['pick'] = pd.Categorical(data_df['pick'],categories=card_names)
+            yield data_df
+
+    if storage == 'dense':
+        data,target = _chunks_to_dense(chunks(),dataset.count_rows(filter=expression),
+                                       pack_cols,pool_cols)
+    else:
+        data,target = _chunks_to_csr(chunks(),pack_cols,pool_cols,
+                                     pack_bits=storage == 'packed',extra_cols=extra_cols)
+    if storage == 'draft':
+        data,target = csr_to_drafts(data,target,len(pack_cols))
+    return data,target,card_name_df
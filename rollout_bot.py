@@ -0,0 +1,153 @@
+import numpy as np
+from nn_utils import pool_logits
+from sim_utils import DraftSimulator
+
+
+class PoolRatingEvaluator(object):
+    def __init__(self, ratings, deck_size=23):
+        """
+        Scores a pool as the sum of the ratings of its deck_size best cards.
+        ratings is a (set_size,) rating per card.
+        """
+        self.ratings = np.asarray(ratings, dtype=np.float32)
+        self.deck_size = deck_size
+        self.order = np.argsort(-self.ratings)
+        self.sorted_ratings = self.ratings[self.order]
+
+    @classmethod
+    def from_model(cls, keras_model, set_size, deck_size=23):
+        """
+        Uses the model's logits for an empty pool (its first pick
+        preferences) as the card ratings
+        """
+        ratings = pool_logits(keras_model, np.zeros((1, set_size)))[0]
+        return cls(ratings, deck_size=deck_size)
+
+    def __call__(self, pools):
+        """
+        pools is (batch, set_size) card counts, returns (batch,) scores
+        """
+        counts = np.asarray(pools)[:, self.order]
+        num_before = np.cumsum(counts, axis=1) - counts
+        num_in_deck = np.clip(self.deck_size - num_before, 0, counts)
+        return num_in_deck @ self.sorted_ratings
+
+
+class RolloutBot(object):
+    def __init__(
+        self,
+        keras_model,
+        draft_creator,
+        num_rollouts=16,
+        evaluator=None,
+        num_seats=8,
+        num_packs=3,
+        pick_mode="max",
+        batch_size=4096,
+        rng=None,
+    ):
+        """
+        Scores each card in the pack by simulating the rest of the draft.
+        For every candidate card, num_rollouts drafts are completed with the
+        keras_model as the policy for every seat (pick_mode "max" or
+        "gumbel"), and the final pool of the bot's seat is scored with
+        evaluator, (batch, set_size) pools -> (batch,) scores.
+        All candidates and rollouts of a decision run as one DraftSimulator,
+        so each pick round is one model call over
+        num_candidates*num_rollouts*num_seats rows.
+
+        Has the same pick_and_add/picks interface as NNBot, see pick_and_add.
+        """
+        self.keras_model = keras_model
+        self.draft_creator = draft_creator
+        self.set_size = draft_creator.get_set_size()
+        self.pack_size = draft_creator.pack_size
+        self.num_rollouts = num_rollouts
+        if evaluator is None:
+            evaluator = PoolRatingEvaluator.from_model(keras_model, self.set_size)
+        self.evaluator = evaluator
+        self.num_seats = num_seats
+        self.num_packs = num_packs
+        self.pick_mode = pick_mode
+        self.batch_size = batch_size
+        if rng is None:
+            rng = np.random.default_rng()
+        self.rng = rng
+        self.reset_picks()
+
+    def reset_picks(self):
+        self.picks = np.zeros((self.set_size), dtype=np.float32)
+
+    def score_candidates(self, packs, pools, pack_num, pick_num, seat=0):
+        """
+        packs is the (num_seats, pack_size) current packs (-1 padding) and
+        pools the (num_seats, set_size) current pools of the whole table.
+        Returns the candidate cards of packs[seat] and their mean rollout
+        score.
+        """
+        pack = packs[seat]
+        candidates = np.unique(pack[pack != -1])
+        num_drafts = len(candidates) * self.num_rollouts
+        simulator = DraftSimulator(
+            self.keras_model,
+            self.draft_creator,
+            num_drafts,
+            num_seats=self.num_seats,
+            num_packs=self.num_packs,
+            batch_size=self.batch_size,
+            rng=self.rng,
+            pick_mode=self.pick_mode,
+        )
+        simulator.set_state(
+            np.broadcast_to(packs, (num_drafts,) + np.shape(packs)),
+            np.broadcast_to(pools, (num_drafts,) + np.shape(pools)),
+            pack_num,
+            pick_num,
+        )
+        # rollouts are grouped by candidate
+        simulator.pick_round(
+            forced_seat=seat, forced_cards=np.repeat(candidates, self.num_rollouts)
+        )
+        final_pools, _ = simulator.finish()
+        scores = self.evaluator(final_pools[:, seat])
+        return candidates, scores.reshape(len(candidates), self.num_rollouts).mean(
+            axis=1
+        )
+
+    def pick_from_table(self, packs, pools, pack_num, pick_num, seat=0):
+        candidates, scores = self.score_candidates(
+            packs, pools, pack_num, pick_num, seat=seat
+        )
+        return candidates[np.argmax(scores)]
+
+    def impute_table(self, pack):
+        """
+        When only the bot's own pack and picks are known, the other seats get
+        random packs with the same number of cards left and empty pools.
+        """
+        num_picked = int(np.sum(self.picks))
+        pack_num = num_picked // self.pack_size
+        pick_num = num_picked % self.pack_size
+        packs = np.full((self.num_seats, self.pack_size), -1, dtype=np.int64)
+        packs[:, : self.pack_size - pick_num] = self.draft_creator.create_packs(
+            self.num_seats, rng=self.rng
+        )[:, : self.pack_size - pick_num]
+        packs[0] = pack
+        pools = np.zeros((self.num_seats, self.set_size), dtype=np.float32)
+        pools[0] = self.picks
+        return packs, pools, pack_num, pick_num
+
+    def pick(self, pack):
+        packs, pools, pack_num, pick_num = self.impute_table(pack)
+        return self.pick_from_table(packs, pools, pack_num, pick_num, seat=0)
+
+    def pick_and_add(self, pack):
+        card_idx = self.pick(pack)
+        out_pack = pack.tolist()
+        self.add(card_idx)
+        out_pack.remove(card_idx)
+        out_pack.append(-1)
+        return np.asarray(out_pack), card_idx
+
+    def add(self, card_idx):
+        self.picks[card_idx] += 1
@@ -30,7 +30,7 @@ class BaseDraftCreator(ABC):
     }
 
     @abstractmethod
-    def create_pack(self):
+    def create_pack(self, rng=None):
         raise NotImplementedError
 
     @abstractmethod
@@ -48,6 +48,41 @@ class BaseDraftCreator(ABC):
     def get_set_size(self):
         return len(self.set_df)
 
+    def get_pack_slots(self):
+        """
+        Describes the pack layout used by create_packs, as a list of
+        (num_cards, options) in pack order. options is a list of
+        (card_idxs, probability), one option is drawn per pack, then num_cards
+        cards are drawn without replacement from its card_idxs.
+        """
+        raise NotImplementedError
+
+    def create_packs(self, n, rng=None):
+        """
+        Creates n packs at once, returns a (n, pack_size) int array.
+        Same slot distributions as create_pack, but every slot is sampled for
+        all n packs at once.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        blocks = []
+        for num_cards, options in self.get_pack_slots():
+            if len(options) == 1:
+                blocks.append(
+                    _sample_without_replacement(rng, options[0][0], n, num_cards)
+                )
+                continue
+            probs = np.asarray([prob for _, prob in options], dtype=np.float64)
+            option_draw = rng.choice(len(options), size=n, p=probs / np.sum(probs))
+            block = np.empty((n, num_cards), dtype=np.int64)
+            for option_idx, (card_idxs, _) in enumerate(options):
+                rows = option_draw == option_idx
+                block[rows] = _sample_without_replacement(
+                    rng, card_idxs, int(np.sum(rows)), num_cards
+                )
+            blocks.append(block)
+        return np.concatenate(blocks, axis=1)
+
     def download_images(self, force_download=False, verbose=0):
         image_set_folder = pjoin(images_path, self.set_code)
         os.makedirs(image_set_folder, exist_ok=True)
@@ -64,6 +99,33 @@ class BaseDraftCreator(ABC):
             open(img_path, "wb").write(r.content)
 
 
+def _sample_without_replacement(rng, card_idxs, n, size, block_size=65536):
+    """
+    n independent draws of size cards without replacement from card_idxs,
+    returns a (n, size) array
+    """
+    card_idxs = np.asarray(card_idxs, dtype=np.int64)
+    if size > len(card_idxs):
+        raise ValueError(
+            "Cannot take {} cards from {} without replacement".format(
+                size, len(card_idxs)
+            )
+        )
+    if size == 1:
+        return card_idxs[rng.integers(len(card_idxs), size=(n, 1))]
+
+    out = np.empty((n, size), dtype=np.int64)
+    # random keys per row, the size smallest keys are the drawn cards
+    for start in range(0, n, block_size):
+        keys = rng.random((min(block_size, n - start), len(card_idxs)))
+        if size < len(card_idxs):
+            order = np.argpartition(keys, size - 1, axis=1)[:, :size]
+        else:
+            order = np.argsort(keys, axis=1)
+        out[start : start + block_size] = card_idxs[order]
+    return out
+
+
 class ScryfallDraftCreator(BaseDraftCreator):
     def __init__(self, set_df, set_code):
         # TODO: need to handle set_df
@@ -123,26 +185,39 @@ class ScryfallDraftCreator(BaseDraftCreator):
 
         return out_str
 
-    def create_pack(self):
+    def create_pack(self, rng=None):
+        if rng is None:
+            rng = np.random
         pack = []
         # add commons
-        pack.extend(np.random.choice(self.commons, size=self.num_common, replace=False))
+        pack.extend(rng.choice(self.commons, size=self.num_common, replace=False))
         # add uncommons
         pack.extend(
-            np.random.choice(self.uncommons, size=self.num_uncommon, replace=False)
+            rng.choice(self.uncommons, size=self.num_uncommon, replace=False)
         )
         # add rare or mythic
-        if np.random.uniform() < self.mythic_prob:
+        if rng.uniform() < self.mythic_prob:
             pack.extend(
-                np.random.choice(self.mythics, size=self.num_rare, replace=False)
+                rng.choice(self.mythics, size=self.num_rare, replace=False)
             )
         else:
-            pack.extend(np.random.choice(self.rares, size=self.num_rare, replace=False))
+            pack.extend(rng.choice(self.rares, size=self.num_rare, replace=False))
 
         # add lands
-        pack.extend(np.random.choice(self.lands, size=self.num_land, replace=False))
+        pack.extend(rng.choice(self.lands, size=self.num_land, replace=False))
         return np.asarray(pack)
 
+    def get_pack_slots(self):
+        return [
+            (self.num_common, [(self.commons, 1)]),
+            (self.num_uncommon, [(self.uncommons, 1)]),
+            (
+                self.num_rare,
+                [(self.mythics, self.mythic_prob), (self.rares, 1 - self.mythic_prob)],
+            ),
+            (self.num_land, [(self.lands, 1)]),
+        ]
+
     def read_pack(self, pack, verbosity=2):
         """"""
         if len(pack.shape) != 1:
@@ -241,76 +316,118 @@ class STXDraftCreator(ScryfallDraftCreator):
         for row_idx, row in self.set_df.iterrows():
             self.idx_dict[self._slot_type_from_row(row)].append(row_idx)
 
-    def create_pack(self):
+    def create_pack(self, rng=None):
         """[summary]
 
         See https://www.lethe.xyz/mtg/collation/stx.html for pack generation
         (Disregard foil changes in probability, MTGA does not use this mechanic)
 
+        Args:
+            rng: np.random.Generator used to draw the pack, defaults to the
+                global np.random state
+
         Raises:
             Exception: [description]
 
         Returns:
             [type]: [description]
         """
+        if rng is None:
+            rng = np.random
         pack = []
         # add commons
         pack.extend(
-            np.random.choice(
+            rng.choice(
                 self.idx_dict["stx_c"], size=self.num_common_slot, replace=False
             )
         )
 
         # add the lesson slot
-        lesson_draw = np.random.multinomial(
+        lesson_draw = rng.multinomial(
             1, [self.common_lesson_rate, self.rare_lesson_rate, self.mythic_lesson_rate]
         )
         if np.argmax(lesson_draw) == 0:
             pack.extend(
-                np.random.choice(self.idx_dict["lesson_c"], size=1, replace=False)
+                rng.choice(self.idx_dict["lesson_c"], size=1, replace=False)
             )
         elif np.argmax(lesson_draw) == 1:
             pack.extend(
-                np.random.choice(self.idx_dict["lesson_r"], size=1, replace=False)
+                rng.choice(self.idx_dict["lesson_r"], size=1, replace=False)
             )
         elif np.argmax(lesson_draw) == 2:
             pack.extend(
-                np.random.choice(self.idx_dict["lesson_m"], size=1, replace=False)
+                rng.choice(self.idx_dict["lesson_m"], size=1, replace=False)
             )
 
         # add 2 uncommons
         pack.extend(
-            np.random.choice(
+            rng.choice(
                 self.idx_dict["stx_u"], size=self.num_uncommon_slot - 1, replace=False
             )
         )
         # for the 3rd uncommon, theres a chance it gets replaced with a lesson uncommon
-        if np.random.uniform() < self.uncommon_lesson_swap_rate:
+        if rng.uniform() < self.uncommon_lesson_swap_rate:
             pack.extend(
-                np.random.choice(self.idx_dict["lesson_u"], size=1, replace=False)
+                rng.choice(self.idx_dict["lesson_u"], size=1, replace=False)
             )
         else:
-            pack.extend(np.random.choice(self.idx_dict["stx_u"], size=1, replace=False))
+            pack.extend(rng.choice(self.idx_dict["stx_u"], size=1, replace=False))
 
         # add rare slot
-        if np.random.uniform() < self.mythic_stx_rate:
-            pack.extend(np.random.choice(self.idx_dict["stx_m"], size=1, replace=False))
+        if rng.uniform() < self.mythic_stx_rate:
+            pack.extend(rng.choice(self.idx_dict["stx_m"], size=1, replace=False))
         else:
-            pack.extend(np.random.choice(self.idx_dict["stx_r"], size=1, replace=False))
+            pack.extend(rng.choice(self.idx_dict["stx_r"], size=1, replace=False))
 
         # add sta slot
-        sta_draw = np.random.multinomial(
+        sta_draw = rng.multinomial(
             1, [self.uncommon_sta_rate, self.rare_sta_rate, self.mythic_sta_rate]
         )
         if np.argmax(sta_draw) == 0:
-            pack.extend(np.random.choice(self.idx_dict["sta_u"], size=1, replace=False))
+            pack.extend(rng.choice(self.idx_dict["sta_u"], size=1, replace=False))
         elif np.argmax(sta_draw) == 1:
-            pack.extend(np.random.choice(self.idx_dict["sta_r"], size=1, replace=False))
+            pack.extend(rng.choice(self.idx_dict["sta_r"], size=1, replace=False))
         elif np.argmax(sta_draw) == 2:
-            pack.extend(np.random.choice(self.idx_dict["sta_m"], size=1, replace=False))
+            pack.extend(rng.choice(self.idx_dict["sta_m"], size=1, replace=False))
 
         return np.asarray(pack)
 
+    def get_pack_slots(self):
+        return [
+            (self.num_common_slot, [(self.idx_dict["stx_c"], 1)]),
+            (
+                1,
+                [
+                    (self.idx_dict["lesson_c"], self.common_lesson_rate),
+                    (self.idx_dict["lesson_r"], self.rare_lesson_rate),
+                    (self.idx_dict["lesson_m"], self.mythic_lesson_rate),
+                ],
+            ),
+            (self.num_uncommon_slot - 1, [(self.idx_dict["stx_u"], 1)]),
+            (
+                1,
+                [
+                    (self.idx_dict["lesson_u"], self.uncommon_lesson_swap_rate),
+                    (self.idx_dict["stx_u"], 1 - self.uncommon_lesson_swap_rate),
+                ],
+            ),
+            (
+                1,
+                [
+                    (self.idx_dict["stx_m"], self.mythic_stx_rate),
+                    (self.idx_dict["stx_r"], 1 - self.mythic_stx_rate),
+                ],
+            ),
+            (
+                1,
+                [
+                    (self.idx_dict["sta_u"], self.uncommon_sta_rate),
+                    (self.idx_dict["sta_r"], self.rare_sta_rate),
+                    (self.idx_dict["sta_m"], self.mythic_sta_rate),
+                ],
+            ),
+        ]
+
     def read_pool_picks(self, bot_pick_vec, verbosity=2):
         """
         bot_pick_vec should be of shape (set_size),
@@ -407,34 +524,49 @@ class M19DraftCreator(BaseDraftCreator):
             if land_name.split("_")[0] not in basic_land_names:
                 self.land_names.add(land_name)
 
-        self.land_idxs = self.label_encoder.transform(list(self.land_names))
+        # sorted, the set order changes between processes (hash randomization)
+        self.land_idxs = self.label_encoder.transform(sorted(self.land_names))
 
-    def create_pack(self):
+    def create_pack(self, rng=None):
+        if rng is None:
+            rng = np.random
         pack = []
 
         for _ in range(self.num_rare):
-            if np.random.uniform() < self.mythic_prob:
+            if rng.uniform() < self.mythic_prob:
                 pack.extend(
-                    np.random.choice(self.rarities_idx["M"], size=1, replace=False)
+                    rng.choice(self.rarities_idx["M"], size=1, replace=False)
                 )
             else:
                 pack.extend(
-                    np.random.choice(self.rarities_idx["R"], size=1, replace=False)
+                    rng.choice(self.rarities_idx["R"], size=1, replace=False)
                 )
         pack.extend(
-            np.random.choice(
+            rng.choice(
                 self.rarities_idx["U"], size=self.num_uncommon, replace=False
             )
         )
         pack.extend(
-            np.random.choice(
+            rng.choice(
                 self.rarities_idx["C"], size=self.num_common, replace=False
             )
         )
-        pack.extend(np.random.choice(self.land_idxs, size=1, replace=False))
+        pack.extend(rng.choice(self.land_idxs, size=1, replace=False))
 
         return np.asarray(pack)
 
+    def get_pack_slots(self):
+        rare_slot = [
+            (self.rarities_idx["M"], self.mythic_prob),
+            (self.rarities_idx["R"], 1 - self.mythic_prob),
+        ]
+        # one rare slot per rare, each drawn independently as in create_pack
+        return [(1, rare_slot) for _ in range(self.num_rare)] + [
+            (self.num_uncommon, [(self.rarities_idx["U"], 1)]),
+            (self.num_common, [(self.rarities_idx["C"], 1)]),
+            (1, [(self.land_idxs, 1)]),
+        ]
+
     def read_pack(self, pack):
         """"""
         if len(pack.shape) != 1:
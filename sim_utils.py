@@ -0,0 +1,362 @@
+import numpy as np
+import multiprocessing
+from nn_utils import gumbel_max_sample, pool_logits
+
+
+class DraftSimulator(object):
+    def __init__(
+        self,
+        model,
+        draft_creator,
+        num_drafts,
+        num_seats=8,
+        num_packs=3,
+        batch_size=1024,
+        rng=None,
+        pick_mode="max",
+        temperature=1.0,
+        top_k=None,
+        logit_cache=None,
+    ):
+        """
+        Simulates num_drafts independent drafts at once, every seat picking
+        with the same model, in 'max' mode (same picks as NNBot) or in 'gumbel'
+        mode (see nn_utils.gumbel_max_sample, with temperature and top_k).
+
+        packs are stored as (num_drafts, num_seats, pack_size) card indices,
+        with picked cards removed and -1 padding at the end, the same way
+        NNBot.pick_and_add returns its out_pack.
+        pools are stored as (num_drafts, num_seats, set_size) card counts.
+        pick_log is (num_drafts, num_seats, num_packs*pack_size), the card
+        picked by each seat at each pick.
+        rng is the np.random.Generator used to create the packs, if None a new
+        unseeded one is created.
+        The model's logits only depend on the pools (see nn_utils.pool_logits),
+        so each pick round computes them once per distinct pool, looked up
+        first in logit_cache (a nn_utils.LogitCache) if one is given, it can
+        be shared across simulators of the same model.
+        """
+        self.model = model
+        self.draft_creator = draft_creator
+        self.set_size = draft_creator.get_set_size()
+        self.pack_size = draft_creator.pack_size
+        self.num_drafts = num_drafts
+        self.num_seats = num_seats
+        self.num_packs = num_packs
+        self.batch_size = batch_size
+        if rng is None:
+            rng = np.random.default_rng()
+        self.rng = rng
+        if pick_mode not in ("max", "gumbel"):
+            raise ValueError("Unknown pick_mode: {}".format(pick_mode))
+        self.pick_mode = pick_mode
+        self.temperature = temperature
+        self.top_k = top_k
+        self.logit_cache = logit_cache
+        self.reset()
+
+    @property
+    def num_rows(self):
+        return self.num_drafts * self.num_seats
+
+    @property
+    def direction(self):
+        if self.pack_num % 2 == 0:
+            return 1
+        else:
+            return -1
+
+    def reset(self):
+        self.pools = np.zeros(
+            (self.num_drafts, self.num_seats, self.set_size), dtype=np.float32
+        )
+        self.packs = np.full(
+            (self.num_drafts, self.num_seats, self.pack_size), -1, dtype=np.int64
+        )
+        self.pick_log = np.full(
+            (self.num_drafts, self.num_seats, self.num_packs * self.pack_size),
+            -1,
+            dtype=np.int64,
+        )
+        self.pack_num = 0
+        self.pick_num = 0
+        self.num_fallback_picks = 0
+
+    def open_packs(self):
+        packs = self.draft_creator.create_packs(self.num_rows, rng=self.rng)
+        self.packs = packs.reshape(self.num_drafts, self.num_seats, self.pack_size)
+
+    def model_input(self):
+        """
+        Returns the (num_drafts*num_seats, 2*set_size) model input, first half
+        is the pool counts, second half is the pack vector
+        """
+        packs = self.packs.reshape(self.num_rows, self.pack_size)
+        model_input = np.zeros((self.num_rows, 2 * self.set_size), dtype=np.float32)
+        model_input[:, : self.set_size] = self.pools.reshape(
+            self.num_rows, self.set_size
+        )
+        row_idx, slot_idx = np.nonzero(packs != -1)
+        model_input[row_idx, self.set_size + packs[row_idx, slot_idx]] = 1
+        return model_input
+
+    def model_output(self):
+        """
+        (num_drafts*num_seats, set_size) model output, the same as the model's
+        predict on model_input, with the logits computed once per distinct
+        pool (e.g. once for all the first picks)
+        """
+        pools = np.ascontiguousarray(self.pools.reshape(self.num_rows, self.set_size))
+        row_keys = pools.view(np.dtype((np.void, pools.dtype.itemsize * self.set_size)))
+        _, first_rows, inverse = np.unique(
+            row_keys[:, 0], return_index=True, return_inverse=True
+        )
+        unique_pools = pools[first_rows]
+        logits = np.empty((len(unique_pools), self.set_size), dtype=np.float32)
+        if self.logit_cache is None:
+            missing = np.arange(len(unique_pools))
+        else:
+            missing = []
+            for pool_idx, pool in enumerate(unique_pools):
+                out = self.logit_cache.get(pool)
+                if out is None:
+                    missing.append(pool_idx)
+                else:
+                    logits[pool_idx] = out
+            missing = np.asarray(missing, dtype=np.int64)
+        if len(missing):
+            logits[missing] = pool_logits(
+                self.model, unique_pools[missing], batch_size=self.batch_size
+            )
+            if self.logit_cache is not None:
+                for pool_idx in missing:
+                    self.logit_cache.put(unique_pools[pool_idx], logits[pool_idx].copy())
+        return logits[inverse.reshape(-1)] * self.pack_mask()
+
+    def pack_mask(self):
+        """
+        (num_drafts*num_seats, set_size) bool, True for the cards in the pack
+        """
+        packs = self.packs.reshape(self.num_rows, self.pack_size)
+        pack_mask = np.zeros((self.num_rows, self.set_size), dtype=bool)
+        row_idx, slot_idx = np.nonzero(packs != -1)
+        pack_mask[row_idx, packs[row_idx, slot_idx]] = True
+        return pack_mask
+
+    def choose(self, out):
+        """
+        Masked argmax (or Gumbel-max sample) for every row. As in
+        NNBot.pick_and_add, if the argmax is not in the pack, the first
+        remaining card in the pack is picked.
+        """
+        packs = self.packs.reshape(self.num_rows, self.pack_size)
+        if self.pick_mode == "gumbel":
+            card_idxs = gumbel_max_sample(
+                out,
+                self.pack_mask(),
+                temperature=self.temperature,
+                top_k=self.top_k,
+                rng=self.rng,
+            )
+            return card_idxs.reshape(self.num_drafts, self.num_seats)
+        card_idxs = np.argmax(out, axis=1)
+        found = np.any(packs == card_idxs[:, None], axis=1)
+        self.num_fallback_picks += int(np.sum(~found))
+        card_idxs = np.where(found, card_idxs, packs[:, 0])
+        return card_idxs.reshape(self.num_drafts, self.num_seats)
+
+    def add_picks(self, card_idxs):
+        """
+        card_idxs is (num_drafts, num_seats), removes each picked card from
+        its pack and adds it to the seat's pool
+        """
+        packs = self.packs.reshape(self.num_rows, self.pack_size)
+        card_idxs = card_idxs.reshape(self.num_rows)
+        rows = np.arange(self.num_rows)
+
+        # remove the first copy of the picked card, shift the rest of the pack
+        slot_idx = np.argmax(packs == card_idxs[:, None], axis=1)
+        keep = np.ones_like(packs, dtype=bool)
+        keep[rows, slot_idx] = False
+        remaining = packs[keep].reshape(self.num_rows, self.pack_size - 1)
+        padding = np.full((self.num_rows, 1), -1, dtype=packs.dtype)
+        self.packs = np.concatenate([remaining, padding], axis=1).reshape(
+            self.num_drafts, self.num_seats, self.pack_size
+        )
+
+        pools = self.pools.reshape(self.num_rows, self.set_size)
+        pools[rows, card_idxs] += 1
+        self.pick_log[:, :, self.pack_num * self.pack_size + self.pick_num] = (
+            card_idxs.reshape(self.num_drafts, self.num_seats)
+        )
+
+    def pass_packs(self):
+        """
+        Seat seat_idx passes its pack to seat (seat_idx + direction)
+        """
+        self.packs = np.roll(self.packs, self.direction, axis=1)
+
+    def set_state(self, packs, pools, pack_num, pick_num):
+        """
+        Starts every draft from the given state, packs is
+        (num_drafts, num_seats, pack_size) with -1 padding, pools is
+        (num_drafts, num_seats, set_size). The pick log is cleared.
+        """
+        self.reset()
+        self.packs = np.array(packs, dtype=np.int64).reshape(
+            self.num_drafts, self.num_seats, self.pack_size
+        )
+        self.pools[:] = pools
+        self.pack_num = pack_num
+        self.pick_num = pick_num
+
+    def pick_round(self, forced_seat=None, forced_cards=None):
+        """
+        One pick for every seat of every draft. If forced_seat is given, that
+        seat picks forced_cards (num_drafts,) instead of the model's pick, the
+        forced cards must be in the seat's pack.
+        """
+        card_idxs = self.choose(self.model_output())
+        if forced_seat is not None:
+            card_idxs[:, forced_seat] = forced_cards
+        self.add_picks(card_idxs)
+        self.pass_packs()
+        self.pick_num += 1
+
+    def finish(self, verbose=0):
+        """
+        Runs the remaining pick rounds, from the current pack_num and
+        pick_num to the end of the draft
+        """
+        while True:
+            if self.pick_num == self.pack_size:
+                if self.pack_num + 1 >= self.num_packs:
+                    break
+                self.pack_num += 1
+                self.pick_num = 0
+                self.open_packs()
+            if verbose:
+                print(
+                    " >> Pack : {} , Pick {}".format(self.pack_num, self.pick_num),
+                    end="\r",
+                )
+            self.pick_round()
+        return self.pools, self.pick_log
+
+    def run(self, verbose=0):
+        self.reset()
+        self.open_packs()
+        return self.finish(verbose=verbose)
+
+
+def pick_statistics(pick_log, set_size, pack_size):
+    """
+    Per card statistics over a (num_drafts, num_seats, num_picks) pick log.
+    Returns the number of times each card was picked and its average pick
+    number within the pack (0 is first pick, nan if never picked).
+    """
+    picks = pick_log.reshape(-1, pick_log.shape[-1])
+    pick_nums = np.broadcast_to(np.arange(picks.shape[1]) % pack_size, picks.shape)
+    valid = picks != -1
+    num_picked = np.bincount(picks[valid], minlength=set_size)
+    pick_num_sum = np.bincount(
+        picks[valid], weights=pick_nums[valid], minlength=set_size
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_pick_num = pick_num_sum / num_picked
+    return num_picked, mean_pick_num
+
+
+_worker_state = {}
+
+
+def _init_worker(model_path, set_code, num_seats, num_packs, batch_size,
+                 logit_cache_size):
+    from nn_utils import LogitCache, load_model
+    from set_utils import get_set_metadata
+
+    _worker_state["model"] = load_model(model_path)
+    _worker_state["draft_creator"] = get_set_metadata(set_code).load_draft_creator()
+    _worker_state["num_seats"] = num_seats
+    _worker_state["num_packs"] = num_packs
+    _worker_state["batch_size"] = batch_size
+    # one cache per worker, shared by its chunks
+    _worker_state["logit_cache"] = (
+        LogitCache(max_size=logit_cache_size) if logit_cache_size > 0 else None
+    )
+
+
+def _simulate_chunk(chunk_args):
+    chunk_idx, num_drafts, seed_seq = chunk_args
+    simulator = DraftSimulator(
+        _worker_state["model"],
+        _worker_state["draft_creator"],
+        num_drafts,
+        num_seats=_worker_state["num_seats"],
+        num_packs=_worker_state["num_packs"],
+        batch_size=_worker_state["batch_size"],
+        rng=np.random.default_rng(seed_seq),
+        logit_cache=_worker_state["logit_cache"],
+    )
+    pools, pick_log = simulator.run()
+    return chunk_idx, pools, pick_log, simulator.num_fallback_picks
+
+
+def simulate_drafts_parallel(
+    model_path,
+    set_code,
+    num_drafts,
+    num_workers=None,
+    seed=None,
+    drafts_per_chunk=256,
+    num_seats=8,
+    num_packs=3,
+    batch_size=1024,
+    verbose=0,
+    logit_cache_size=0,
+):
+    """
+    Splits num_drafts drafts into chunks of drafts_per_chunk drafts and
+    simulates them over a process pool. Each worker loads the model once,
+    and has its own LogitCache of logit_cache_size pools (if > 0).
+
+    Every chunk gets its own np.random.Generator, spawned from seed, so the
+    merged output for a given seed (and drafts_per_chunk) is the same whatever
+    the number of workers.
+
+    Returns the merged pools, pick log and number of fallback picks, in the
+    same layout as DraftSimulator.run
+    """
+    chunk_sizes = [drafts_per_chunk] * (num_drafts // drafts_per_chunk)
+    if num_drafts % drafts_per_chunk:
+        chunk_sizes.append(num_drafts % drafts_per_chunk)
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    chunk_args = list(zip(range(len(chunk_sizes)), chunk_sizes, seed_seqs))
+
+    # spawn, keras/tensorflow isn't fork safe
+    ctx = multiprocessing.get_context("spawn")
+    results = [None] * len(chunk_sizes)
+    num_fallback_picks = 0
+    with ctx.Pool(
+        num_workers,
+        initializer=_init_worker,
+        initargs=(
+            model_path,
+            set_code,
+            num_seats,
+            num_packs,
+            batch_size,
+            logit_cache_size,
+        ),
+    ) as pool:
+        for num_done, (chunk_idx, pools, pick_log, num_fallback) in enumerate(
+            pool.imap_unordered(_simulate_chunk, chunk_args)
+        ):
+            results[chunk_idx] = (pools, pick_log)
+            num_fallback_picks += num_fallback
+            if verbose:
+                print(" >> Chunk {}/{}".format(num_done + 1, len(chunk_sizes)), end="\r")
+
+    pools = np.concatenate([pools for pools, _ in results], axis=0)
+    pick_log = np.concatenate([pick_log for _, pick_log in results], axis=0)
+    return pools, pick_log, num_fallback_picks
@@ -1,8 +1,9 @@
-from nn_utils import NNBot
+from nn_utils import NNBot, TablePicker, LogitCache, load_model
 import argparse
-import keras
 import sys
 from set_utils import get_set_metadata
+from sim_utils import DraftSimulator, simulate_drafts_parallel, pick_statistics
+import numpy as np
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(
@@ -11,16 +12,51 @@ if __name__ == '__main__':
     parser.add_argument(
         "--model_hdf5", action="store", dest="model_hdf5",
         required=True,
-        help=("path to the model_hdf5 ")
+        help=("path to the model_hdf5, or to a .npz exported by export_numpy_model.py")
     )
     parser.add_argument(
         "--set_code", action="store", dest="set_code",
         required=True,
         help=("3-symbol code for the set, (only 'm19' and 'stx' available atm) ")
     )
+    parser.add_argument(
+        "--num_drafts", action="store", dest="num_drafts",
+        default=None,type=int,
+        help=("number of drafts to simulate at once with the batched simulator, "
+              "if not set, a single draft is simulated and the decks are printed")
+    )
+    parser.add_argument(
+        "--output_npz", action="store", dest="output_npz",
+        default=None,
+        help=("path to the output npz, saves the pools and the pick log of all drafts "
+              "(only used with --num_drafts)")
+    )
+    parser.add_argument(
+        "--workers", action="store", dest="workers",
+        default=None,type=int,
+        help=("number of worker processes to split the --num_drafts drafts over, "
+              "if not set, all drafts are simulated in this process")
+    )
+    parser.add_argument(
+        "--seed", action="store", dest="seed",
+        default=None,type=int,
+        help=("random seed for the --workers mode, the output only depends "
+              "on the seed and --drafts_per_chunk, not on the number of workers")
+    )
+    parser.add_argument(
+        "--drafts_per_chunk", action="store", dest="drafts_per_chunk",
+        default=256,type=int,
+        help=("number of drafts simulated per task in the --workers mode")
+    )
+    parser.add_argument(
+        "--logit_cache_size", action="store", dest="logit_cache_size",
+        default=4096,type=int,
+        help=("max number of pools in the logit cache shared by the drafts of --num_drafts "
+              "(one cache per worker with --workers), 0 to disable. Not used for a single "
+              "draft, the bots only share it within the draft")
+    )
 
     args = parser.parse_args()
-    model = keras.models.load_model(args.model_hdf5)
     set_code = args.set_code
     set_metadata = get_set_metadata(set_code)
     draft_coord = set_metadata.load_draft_creator()
@@ -29,6 +65,47 @@ if __name__ == '__main__':
     num_packs = 3
     num_cards_per_pack = 15
 
+    if args.num_drafts is not None:
+        if args.workers is not None:
+            pools,pick_log,_ = simulate_drafts_parallel(args.model_hdf5,set_code,
+                                                        args.num_drafts,
+                                                        num_workers=args.workers,
+                                                        seed=args.seed,
+                                                        drafts_per_chunk=args.drafts_per_chunk,
+                                                        num_seats=num_bots,
+                                                        num_packs=num_packs,
+                                                        verbose=1,
+                                                        logit_cache_size=args.logit_cache_size)
+        else:
+            model = load_model(args.model_hdf5)
+            rng = np.random.default_rng(args.seed)
+            logit_cache = None
+            if args.logit_cache_size > 0:
+                logit_cache = LogitCache(max_size=args.logit_cache_size)
+            simulator = DraftSimulator(model,draft_coord,args.num_drafts,
+                                       num_seats=num_bots,num_packs=num_packs,
+                                       rng=rng,logit_cache=logit_cache)
+            pools,pick_log = simulator.run(verbose=1)
+            if logit_cache is not None:
+                print()
+                print('logit cache: {}'.format(logit_cache.info()))
+        print()
+        print('Simulated {} drafts'.format(args.num_drafts))
+        if args.output_npz is not None:
+            num_picked,mean_pick_num = pick_statistics(pick_log,
+                                                       draft_coord.get_set_size(),
+                                                       draft_coord.pack_size)
+            np.savez(args.output_npz,pools=pools,picks=pick_log,
+                     num_picked=num_picked,mean_pick_num=mean_pick_num)
+        else:
+            for bot_idx in range(num_bots):
+                print()
+                print('Bot_Num: {}'.format(bot_idx))
+                print(draft_coord.read_pool_picks(pools[0,bot_idx]))
+        sys.exit(0)
+
+    model = load_model(args.model_hdf5)
+
     #create bots
     bot_list = []
     for _ in range(num_bots):
@@ -37,6 +114,7 @@ if __name__ == '__main__':
                       pick_mode='max'
                       )
         bot_list.append(nnbot)
+    table = TablePicker(bot_list)
 
     #simulate the draft
     for pack_num in range(num_packs):
@@ -49,15 +127,10 @@ if __name__ == '__main__':
             packs.append(draft_coord.create_pack())
 
         for pick_num in range(num_cards_per_pack):
-            new_packs = [[] for _ in range(num_bots)]
-            for bot_idx,nnbot in enumerate(bot_list):
-                sys.stdout.write('\r >> Pack : {} , Pick {} , Bot {}'.format(pack_num,pick_num,bot_idx))
-                sys.stdout.flush()
-                pack = packs[bot_idx]
-                out_pack,_ = nnbot.pick_and_add(pack)
-                out_bot_idx = (bot_idx + dir) %(num_bots)
-                new_packs[out_bot_idx] = out_pack
-            packs = new_packs
+            sys.stdout.write('\r >> Pack : {} , Pick {}'.format(pack_num,pick_num))
+            sys.stdout.flush()
+            out_packs,_ = table.pick_and_add(packs)
+            packs = table.pass_packs(out_packs,dir)
 
 
 
@@ -66,3 +139,4 @@ if __name__ == '__main__':
         print('Bot_Num: {}'.format(bot_idx))
 
         print(draft_coord.read_pool_picks(nnbot.picks))
+
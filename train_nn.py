@@ -1,14 +1,17 @@
 
 import pandas as pd
 import pickle
+import os
 from os.path import join as pjoin
 import draftsimtools as ds
 import argparse
 import utils
 import tensorflow as tf
 import nn_utils
+import train_utils
 import numpy as np
 import keras
+from providers import seventeen_lands
 
 
 if __name__ == '__main__':
@@ -18,13 +21,29 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         "--train_pkl", action="store", dest="train_pkl",
-        required=True,
-        help=("path to the train_pkl ")
+        default=None,
+        help=("path to the train_pkl, or to a dataset directory (see utils.save_dataset)")
     )
     parser.add_argument(
         "--test_pkl", action="store", dest="test_pkl",
-        required=True,
-        help=("path to the test_pkl ")
+        default=None,
+        help=("path to the test_pkl, or to a dataset directory (see utils.save_dataset)")
+    )
+    parser.add_argument(
+        "--train_csv", action="store", dest="train_csv",
+        default=None,
+        help=("path to a 17lands draft csv to stream the training and test data from, "
+              "instead of --train_pkl/--test_pkl")
+    )
+    parser.add_argument(
+        "--test_fraction", action="store", dest="test_fraction",
+        default=0.2,type=float,
+        help=("fraction of the drafts of --train_csv used as test data (assigned by a hash of the draft_id)")
+    )
+    parser.add_argument(
+        "--max_memory_mb", action="store", dest="max_memory_mb",
+        default=512,type=float,
+        help=("size of the shuffle buffer of each --train_csv reader, in MB")
     )
     parser.add_argument(
         "--output_name", action="store", dest="output_name",
@@ -41,6 +60,39 @@ if __name__ == '__main__':
         default=0.5,type=float,
         help=("fraction of the training set to go through per epoch")
     )
+    parser.add_argument(
+        "--input_pipeline", action="store", dest="input_pipeline",
+        default="batch",choices=["batch","sample"],
+        help=("'batch' builds whole batches with the processors' get_batch, "
+              "'sample' is the old one sample at a time generator")
+    )
+    parser.add_argument(
+        "--num_workers", action="store", dest="num_workers",
+        default=2,type=int,
+        help=("number of parallel batch producers (only for --input_pipeline batch)")
+    )
+    parser.add_argument(
+        "--profile", action="store_true", dest="profile",
+        help=("write per epoch throughput, step times, the time the input workers spend "
+              "building batches (input_busy_fraction, near 1 the input pipeline is the "
+              "bottleneck) and peak RSS to {output_name}_profile.json")
+    )
+    parser.add_argument(
+        "--profile_trace_steps", action="store", dest="profile_trace_steps",
+        default=None,
+        help=("'start,stop', with --profile also capture a TF profiler trace of these "
+              "global training steps in {output_name}_trace")
+    )
+    parser.add_argument(
+        "--resume", action="store_true", dest="resume",
+        help=("resume from the last checkpoint in {output_name}_checkpoint "
+              "(weights, optimizer, epoch/step, early stopping and data position)")
+    )
+    parser.add_argument(
+        "--checkpoint_every", action="store", dest="checkpoint_every",
+        default=1000,type=int,
+        help=("number of training steps between checkpoints, there is also one at the end of every epoch")
+    )
     args = parser.parse_args()
     batch_size = args.batch_size
     train_pkl = args.train_pkl
@@ -50,12 +102,17 @@ if __name__ == '__main__':
     if train_fraction >1:
         raise ValueError("train_fraction must be less than 1")
     
-    train_data = pickle.load(open(train_pkl,'rb'))
-    test_data = pickle.load(open(test_pkl,'rb'))
-
-
-    train_processor = utils.get_processor(train_data)
-    test_processor = utils.get_processor(test_data)
+    if args.train_csv is not None:
+        if args.input_pipeline != 'batch':
+            raise ValueError("--train_csv requires --input_pipeline batch")
+        train_processor,test_processor = seventeen_lands.open_csv_splits(
+            args.train_csv,test_fraction=args.test_fraction,max_memory_mb=args.max_memory_mb)
+        print('csv streaming, per reader {}'.format(train_processor.memory_report()))
+    elif train_pkl is None or test_pkl is None:
+        raise ValueError("--train_pkl and --test_pkl are required without --train_csv")
+    else:
+        train_processor = utils.open_processor(train_pkl)
+        test_processor = utils.open_processor(test_pkl)
 
     if train_processor.get_set_size() != test_processor.get_set_size():
         raise Exception("""Computed number of cards in the set is different for train and test data. 
@@ -64,14 +121,54 @@ if __name__ == '__main__':
                             """.format(train_processor.get_set_size(),
                                         test_processor.get_set_size()))
     
+    if train_processor.has_sample_weights():
+        if args.input_pipeline != 'batch':
+            raise ValueError("deduplicated (weighted) data requires --input_pipeline batch")
+        print('training on {} unique samples, weighted by their number of copies'.format(
+            len(train_processor)))
+
+    output_prefix = os.path.splitext(output_name)[0]
+    checkpoint_dir = output_prefix+'_checkpoint'
+    state = None
+    if args.resume:
+        if args.input_pipeline != 'batch':
+            raise ValueError("--resume requires --input_pipeline batch")
+        state = train_utils.TrainingStateCallback.load_state(checkpoint_dir)
+        if state is None:
+            print('no checkpoint in {}, starting from scratch'.format(checkpoint_dir))
+    if state is None:
+        #the data order is fixed by this seed, so a resumed run can skip the seen batches
+        data_seed = np.random.SeedSequence().entropy
+    else:
+        data_seed = state['data_seed']
+
     num_train = len(train_processor)
     num_test = len(test_processor)
-    train_steps = (num_train*train_fraction) // batch_size
+    train_steps = int((num_train*train_fraction) // batch_size)
     test_steps = num_test // batch_size
-    train_dataset = tf.data.Dataset.from_generator(train_processor.get_iter,
-                                                     output_types=(tf.int16,tf.int16))
-    test_dataset = tf.data.Dataset.from_generator(test_processor.get_iter,
-                                                    output_types=(tf.int16, tf.int16))
+
+    def make_train_dataset(start_batch):
+        if args.input_pipeline == 'batch':
+            train_dataset = train_utils.make_batch_dataset(train_processor,batch_size,
+                                                           num_workers=args.num_workers,
+                                                           seed=data_seed,
+                                                           start_batch=start_batch,
+                                                           timer=input_timer)
+        else:
+            train_dataset = tf.data.Dataset.from_generator(train_processor.get_iter,
+                                                             output_types=(tf.int16,tf.int16))
+            train_dataset = train_dataset.batch(batch_size)
+        return train_dataset
+
+    if args.input_pipeline == 'batch':
+        #the streamed test data isn't shuffled, it doesn't need a shuffle buffer
+        test_dataset = train_utils.make_batch_dataset(test_processor,batch_size,
+                                                      shuffle=args.train_csv is None,
+                                                      num_workers=args.num_workers)
+    else:
+        test_dataset = tf.data.Dataset.from_generator(test_processor.get_iter,
+                                                        output_types=(tf.int16, tf.int16))
+        test_dataset = test_dataset.batch(batch_size)
 
 
     input_size = train_processor.get_set_size()*2
@@ -86,13 +183,59 @@ if __name__ == '__main__':
                   metrics=[metric]
                   )
 
+    early_stopping = tf.keras.callbacks.EarlyStopping(patience=5)
+    model_checkpoint = tf.keras.callbacks.ModelCheckpoint(filepath=output_name,
+                                                          save_best_only=True)
+    state_callback = train_utils.TrainingStateCallback(checkpoint_dir,early_stopping,
+                                                       model_checkpoint,data_seed,
+                                                       save_every_steps=args.checkpoint_every)
     my_callbacks = [
-        tf.keras.callbacks.EarlyStopping(patience=5),
-        tf.keras.callbacks.ModelCheckpoint(filepath=output_name,
-                                           save_best_only=True),
+        early_stopping,
+        model_checkpoint,
+        state_callback,
     ]
-    model.fit(train_dataset.batch(batch_size),epochs=50,
-              steps_per_epoch=train_steps,
-              validation_data=test_dataset.batch(batch_size),
-              validation_steps=test_steps,
-              callbacks=my_callbacks)
+    input_timer = None
+    if args.profile:
+        #the input workers are only timed in the batch pipeline
+        if args.input_pipeline == 'batch':
+            input_timer = train_utils.InputTimer()
+        trace_steps = None
+        if args.profile_trace_steps is not None:
+            trace_steps = [int(step) for step in args.profile_trace_steps.split(',')]
+        my_callbacks.append(train_utils.ProfilerCallback(output_prefix+'_profile.json',
+                                                         timer=input_timer,
+                                                         trace_dir=output_prefix+'_trace',
+                                                         trace_steps=trace_steps))
+
+    epochs = 50
+    initial_epoch = 0
+    if state is not None and state['early_stopping']['stopped_epoch'] > 0:
+        print('the checkpointed run already stopped early, at epoch {}'.format(
+            state['early_stopping']['stopped_epoch']))
+        epochs = initial_epoch
+    elif state is not None:
+        state_callback.restore(model,state)
+        initial_epoch = state['epoch']
+        print('resuming from epoch {}, step {}'.format(state['epoch'],state['step_in_epoch']))
+        if state['step_in_epoch'] > 0:
+            #finish the interrupted epoch first, with only its remaining steps
+            model.fit(make_train_dataset(state_callback.global_step),
+                      epochs=initial_epoch+1,
+                      initial_epoch=initial_epoch,
+                      steps_per_epoch=max(train_steps - state['step_in_epoch'],1),
+                      validation_data=test_dataset,
+                      validation_steps=test_steps,
+                      callbacks=my_callbacks)
+            initial_epoch += 1
+            if model.stop_training:
+                epochs = initial_epoch
+
+    if initial_epoch < epochs:
+        model.fit(make_train_dataset(state_callback.global_step),epochs=epochs,
+                  initial_epoch=initial_epoch,
+                  steps_per_epoch=train_steps,
+                  validation_data=test_dataset,
+                  validation_steps=test_steps,
+                  callbacks=my_callbacks)
+    if args.train_csv is not None:
+        print('csv streaming, per reader {}'.format(train_processor.memory_report()))
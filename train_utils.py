@@ -0,0 +1,320 @@
+import json
+import os
+import resource
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+
+
+def make_batch_dataset(processor, batch_size, shuffle=True, num_workers=1,
+                       seed=None, start_batch=0, timer=None):
+    """
+    tf.data pipeline yielding whole int16 (x, y) batches from
+    processor.get_batch_iter. num_workers generators run in parallel, each
+    covering its share of the batches of every epoch, and their batches are
+    interleaved in a fixed order. Batches are prefetched.
+    If the processor has sample weights (see has_sample_weights), the
+    batches are (x, y, sample_weight), which model.fit uses as is.
+    start_batch is the number of batches of the dataset already consumed (with
+    the same seed), the dataset picks up from there.
+    num_workers is capped by processor.get_num_workers, so that no worker is
+    left without batches.
+    If timer (an InputTimer) is given, the time the workers spend building
+    their batches, and the batch sizes, are added to it.
+    """
+    num_workers = processor.get_num_workers(batch_size, num_workers)
+    if timer is not None:
+        timer.num_workers = num_workers
+    if seed is None:
+        # all workers must shuffle with the same seed
+        seed = np.random.SeedSequence().entropy
+    set_size = processor.get_set_size()
+    #output_types/output_shapes rather than output_signature, which needs TF 2.4
+    output_types = (tf.int16, tf.int16)
+    output_shapes = (tf.TensorShape([None, 2 * set_size]), tf.TensorShape([None, set_size]))
+    weighted = processor.has_sample_weights()
+    if weighted:
+        output_types += (tf.float32,)
+        output_shapes += (tf.TensorShape([None]),)
+
+    def worker_generator(worker_idx):
+        worker_idx = int(worker_idx)
+        #the interleave takes the batches from the workers in turn
+        worker_start_batch = len(range(worker_idx, start_batch, num_workers))
+        batches = processor.get_batch_iter(batch_size, shuffle=shuffle,
+                                           worker_idx=worker_idx,
+                                           num_workers=num_workers,
+                                           seed=seed,
+                                           start_batch=worker_start_batch)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+            x = batch[0].astype(np.int16, copy=False)
+            y = batch[1].astype(np.int16, copy=False)
+            if timer is not None:
+                timer.add(time.perf_counter() - start, len(x))
+            if weighted:
+                yield x, y, batch[2]
+            else:
+                yield x, y
+
+    def worker_dataset(worker_idx):
+        return tf.data.Dataset.from_generator(worker_generator,
+                                              output_types=output_types,
+                                              output_shapes=output_shapes,
+                                              args=(worker_idx,))
+
+    #batch start_batch comes from worker start_batch % num_workers
+    worker_order = (np.arange(num_workers) + start_batch) % num_workers
+    dataset = tf.data.Dataset.from_tensor_slices(worker_order).interleave(
+        worker_dataset,
+        cycle_length=num_workers,
+        num_parallel_calls=num_workers,
+        deterministic=True,
+    )
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+class InputTimer(object):
+    def __init__(self):
+        """
+        Accumulates the time the make_batch_dataset workers spend building
+        batches (summed over the workers), and the batches' number of
+        samples. num_workers is set by make_batch_dataset.
+        """
+        self.lock = threading.Lock()
+        self.build_time = 0.0
+        self.num_samples = 0
+        self.num_workers = 1
+
+    def add(self, build_time, num_samples):
+        with self.lock:
+            self.build_time += build_time
+            self.num_samples += num_samples
+
+    def pop(self):
+        """
+        build time and number of samples since the last pop
+        """
+        with self.lock:
+            out = (self.build_time, self.num_samples)
+            self.build_time = 0.0
+            self.num_samples = 0
+        return out
+
+
+def peak_rss_mb():
+    #ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ProfilerCallback(tf.keras.callbacks.Callback):
+    def __init__(self, output_json, timer=None, trace_dir=None, trace_steps=None):
+        """
+        Records, per epoch, the wall time of each step, the peak RSS of the
+        process and, with the timer given to make_batch_dataset, the training
+        throughput (samples/sec) and how busy the input workers were:
+        input_busy_fraction is their batch building time over num_workers
+        times the training time, near 1 the input pipeline is the bottleneck.
+        Samples are counted as their batches are built, a prefetch buffer
+        ahead of the steps. The records of all the epochs so far are
+        rewritten to output_json at the end of each epoch.
+        If trace_dir and trace_steps, (start, stop) global step numbers, are
+        given, a TF profiler trace of steps start to stop-1 is written to
+        trace_dir.
+        """
+        super(ProfilerCallback, self).__init__()
+        self.output_json = output_json
+        self.timer = timer
+        self.trace_dir = trace_dir
+        self.trace_steps = trace_steps
+        self.records = []
+        self.global_step = 0
+        self.tracing = False
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.step_times = []
+        self.build_time = 0.0
+        self.num_samples = 0
+        if self.timer is not None:
+            self.timer.pop()
+        self.epoch_start = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_steps is not None and self.global_step == self.trace_steps[0]:
+            tf.profiler.experimental.start(self.trace_dir)
+            self.tracing = True
+        self.step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step_times.append(time.perf_counter() - self.step_start)
+        if self.timer is not None:
+            build_time, num_samples = self.timer.pop()
+            self.build_time += build_time
+            self.num_samples += num_samples
+        self.global_step += 1
+        if self.tracing and self.global_step >= self.trace_steps[1]:
+            self.stop_trace()
+
+    def stop_trace(self):
+        tf.profiler.experimental.stop()
+        self.tracing = False
+        print('profiler trace written to {}'.format(self.trace_dir))
+
+    def on_epoch_end(self, epoch, logs=None):
+        #the epoch time includes the validation
+        epoch_time = time.perf_counter() - self.epoch_start
+        step_times = np.asarray(self.step_times)
+        train_time = float(np.sum(step_times))
+        record = {
+            'epoch': epoch,
+            'steps': len(step_times),
+            'epoch_time': epoch_time,
+            'train_time': train_time,
+            'step_time_mean': float(np.mean(step_times)) if len(step_times) else None,
+            'step_time_median': float(np.median(step_times)) if len(step_times) else None,
+            'step_time_p90': float(np.percentile(step_times, 90)) if len(step_times) else None,
+            'step_time_max': float(np.max(step_times)) if len(step_times) else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'logs': {name: float(value) for name, value in (logs or {}).items()},
+        }
+        if self.timer is not None:
+            worker_time = self.timer.num_workers * train_time
+            record['samples'] = self.num_samples
+            record['samples_per_sec'] = self.num_samples / train_time if train_time else None
+            record['input_build_time'] = self.build_time
+            record['input_workers'] = self.timer.num_workers
+            record['input_busy_fraction'] = self.build_time / worker_time if worker_time else None
+        self.records.append(record)
+        with open(self.output_json, 'w') as f:
+            json.dump(self.records, f, indent=2)
+
+    def on_train_end(self, logs=None):
+        if self.tracing:
+            self.stop_trace()
+
+
+class TrainingStateCallback(tf.keras.callbacks.Callback):
+    state_name = 'state.json'
+
+    def __init__(self, checkpoint_dir, early_stopping, model_checkpoint, data_seed,
+                 save_every_steps=1000):
+        """
+        Periodic checkpoints of everything needed to resume training: the
+        model weights and optimizer state (tf.train.Checkpoint), the epoch,
+        step within the epoch and number of training batches consumed (the
+        sampler position, with data_seed), and the EarlyStopping and
+        ModelCheckpoint counters.
+        Saved every save_every_steps training steps and at the end of every
+        epoch. Must come after early_stopping and model_checkpoint in the
+        callback list, so that it saves their updated state, and restores the
+        last saved one after they reset it in on_train_begin (so that their
+        counters carry over a resume, or several fit calls).
+        The weights are written under a new prefix before state.json is
+        replaced, so a crash while saving leaves the previous checkpoint
+        usable.
+        """
+        super(TrainingStateCallback, self).__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.early_stopping = early_stopping
+        self.model_checkpoint = model_checkpoint
+        self.data_seed = data_seed
+        self.save_every_steps = save_every_steps
+        self.epoch = 0
+        self.step_in_epoch = 0
+        self.global_step = 0
+        self.resume_step_in_epoch = 0
+        self.last_state = None
+        self.weights_prefix = None
+
+    def get_checkpoint(self):
+        return tf.train.Checkpoint(model=self.model, optimizer=self.model.optimizer)
+
+    @classmethod
+    def load_state(cls, checkpoint_dir):
+        """
+        The saved state dict, None if there is no checkpoint
+        """
+        state_path = os.path.join(checkpoint_dir, cls.state_name)
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path) as f:
+            return json.load(f)
+
+    def restore(self, model, state):
+        """
+        Loads the weights and optimizer state of model from the checkpoint of
+        state (see load_state). The callback counters are restored at the
+        start of the next fit.
+        """
+        self.set_model(model)
+        self.get_checkpoint().read(state['weights_prefix']).expect_partial()
+        self.last_state = state
+        self.weights_prefix = state['weights_prefix']
+        self.epoch = state['epoch']
+        self.step_in_epoch = state['step_in_epoch']
+        self.resume_step_in_epoch = state['step_in_epoch']
+        self.global_step = state['global_step']
+
+    def on_train_begin(self, logs=None):
+        state = self.last_state
+        if state is None:
+            return
+        self.early_stopping.wait = state['early_stopping']['wait']
+        self.early_stopping.best = state['early_stopping']['best']
+        self.early_stopping.stopped_epoch = state['early_stopping']['stopped_epoch']
+        self.model_checkpoint.best = state['model_checkpoint_best']
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self.step_in_epoch = self.resume_step_in_epoch
+        self.resume_step_in_epoch = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step_in_epoch += 1
+        self.global_step += 1
+        if self.global_step % self.save_every_steps == 0:
+            self.save(self.epoch, self.step_in_epoch)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.save(epoch + 1, 0)
+
+    def save(self, epoch, step_in_epoch):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        weights_prefix = os.path.join(self.checkpoint_dir,
+                                      'weights-{}'.format(self.global_step))
+        weights_prefix = self.get_checkpoint().write(weights_prefix)
+        state = {
+            'epoch': epoch,
+            'step_in_epoch': step_in_epoch,
+            'global_step': self.global_step,
+            'data_seed': self.data_seed,
+            'weights_prefix': weights_prefix,
+            'early_stopping': {
+                'wait': int(self.early_stopping.wait),
+                'best': _to_json_float(self.early_stopping.best),
+                'stopped_epoch': int(self.early_stopping.stopped_epoch),
+            },
+            'model_checkpoint_best': _to_json_float(self.model_checkpoint.best),
+        }
+        state_path = os.path.join(self.checkpoint_dir, self.state_name)
+        with open(state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(state_path + '.tmp', state_path)
+
+        old_prefix = self.weights_prefix
+        self.weights_prefix = weights_prefix
+        if old_prefix is not None and old_prefix != weights_prefix:
+            for path in tf.io.gfile.glob(old_prefix + '.*'):
+                tf.io.gfile.remove(path)
+        self.last_state = state
+
+
+def _to_json_float(value):
+    if value is None:
+        return None
+    return float(value)
@@ -1,26 +1,240 @@
 import numpy as np
+import json
+import os
+import pickle
+import threading
+from os.path import join as pjoin
 
 basic_land_names = set(['plains','island','swamp','mountain','forest'])
 
+dataset_header_name = 'header.json'
+
 
 def get_data_format(pkl_data):
     if isinstance(pkl_data,np.ndarray):
         return 'draft'
     elif isinstance(pkl_data,dict):
+        if pkl_data['data_format'] in ('csr', 'packed', 'mixed'):
+            return pkl_data['data_format']
         if pkl_data['data_format']:
             return 'sparse'
     raise ValueError('Unknown pkl_data format')
 
+
+def dense_to_csr(dense):
+    """CSR representation of a 2d array, returns indptr, indices and data.
+    """
+    rows, cols = np.nonzero(dense)
+    indptr = np.zeros(len(dense) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(dense)), out=indptr[1:])
+    return indptr, cols.astype(np.uint16), dense[rows, cols]
+
+
+def slice_csr(csr_dict, start, stop):
+    """Rows start:stop of a csr dict ('indptr', 'indices', 'data', 'pick',
+    'pack_bits' for the packed format and 'count' for deduplicated data).
+    """
+    indptr = csr_dict['indptr'][start:stop + 1]
+    out_dict = dict(csr_dict)
+    out_dict['indptr'] = indptr - indptr[0]
+    out_dict['indices'] = csr_dict['indices'][indptr[0]:indptr[-1]]
+    out_dict['data'] = csr_dict['data'][indptr[0]:indptr[-1]]
+    for name in ('pick', 'pack_bits', 'count'):
+        if name in csr_dict:
+            out_dict[name] = csr_dict[name][start:stop]
+    return out_dict
+
+
+def take_csr(csr_dict, rows):
+    """Rows (an array of row indices) of a csr dict, see slice_csr.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = csr_dict['indptr'][rows]
+    lengths = csr_dict['indptr'][rows + 1] - starts
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+    out_dict = dict(csr_dict)
+    out_dict['indptr'] = indptr
+    out_dict['indices'] = csr_dict['indices'][positions]
+    out_dict['data'] = csr_dict['data'][positions]
+    for name in ('pick', 'pack_bits', 'count'):
+        if name in csr_dict:
+            out_dict[name] = csr_dict[name][rows]
+    return out_dict
+
+
+def save_dataset(output_dir, pkl_data):
+    """Save pkl_data (a draft tensor, or a sparse dict) as a dataset directory:
+    one .npy per array ('drafts.npy', 'x.npy' and 'y.npy', or the csr/packed/mixed arrays) and a small
+    json header with the data_format and the number of cards in the set.
+    """
+    data_format = get_data_format(pkl_data)
+    if data_format == 'draft':
+        arrays = {'drafts': pkl_data}
+        num_cards_in_set = int(np.max(pkl_data)) + 1
+    elif data_format in ('csr', 'packed'):
+        names = ['indptr', 'indices', 'data', 'pick']
+        if data_format == 'packed':
+            names.append('pack_bits')
+        if 'count' in pkl_data:
+            names.append('count')
+        arrays = {name: pkl_data[name] for name in names}
+        num_cards_in_set = int(pkl_data['num_cards_in_set'])
+    elif data_format == 'mixed':
+        names = ['drafts', 'indptr', 'indices', 'data', 'pick']
+        arrays = {name: pkl_data[name] for name in names}
+        num_cards_in_set = int(pkl_data['num_cards_in_set'])
+    else:
+        arrays = {'x': pkl_data['x'], 'y': pkl_data['y']}
+        num_cards_in_set = int(pkl_data['y'].shape[1])
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(pjoin(output_dir, name + '.npy'), array)
+    header = {'data_format': data_format,
+              'num_cards_in_set': num_cards_in_set,
+              'arrays': sorted(arrays)}
+    with open(pjoin(output_dir, dataset_header_name), 'w') as f:
+        json.dump(header, f)
+
+
+def load_dataset(path):
+    """Load a dataset saved with save_dataset, or a pkl.
+    Returns the data in the same form as the pkls, and the kwargs for
+    get_processor. Dataset directories are memory-mapped, so only the pages
+    that are used get read.
+    """
+    if not os.path.isdir(path):
+        return pickle.load(open(path, 'rb')), {}
+
+    with open(pjoin(path, dataset_header_name)) as f:
+        header = json.load(f)
+    arrays = {name: np.load(pjoin(path, name + '.npy'), mmap_mode='r')
+              for name in header['arrays']}
+    kwargs = {'num_cards_in_set': header['num_cards_in_set']}
+    if header['data_format'] == 'draft':
+        return arrays['drafts'], kwargs
+    arrays['data_format'] = header['data_format']
+    return arrays, kwargs
+
+
+def open_processor(path, **kwargs):
+    """Processor for a pkl or a dataset directory.
+    """
+    data, data_kwargs = load_dataset(path)
+    data_kwargs.update(kwargs)
+    return get_processor(data, **data_kwargs)
+
+
 def get_processor(pkl_data,**kwargs):
     data_format = get_data_format(pkl_data)
     
     if data_format == 'draft':
         return DraftFormatProcessor(pkl_data,**kwargs)
-    elif data_format == 'sparse':
+    elif data_format in ('sparse', 'csr', 'packed'):
         return SparseFormatProcessor(pkl_data,**kwargs)
+    elif data_format == 'mixed':
+        return MixedFormatProcessor(pkl_data,**kwargs)
     raise ValueError('Unknown pkl_data format')
 
 
+def dedup_samples(processor, block_size=65536, seed=0):
+    """Collapses the duplicate (x, y) samples of processor into a csr dict
+    (see SparseFormatProcessor) of the unique samples, with the number of
+    copies of each in 'count'.
+    Samples are grouped by a 64 bit hash (random linear combination of the
+    x values and the picked card, mod 2**64), so only the hashes of the
+    whole dataset are held in memory, rows are read block_size at a time.
+    """
+    num_samples = len(processor)
+    set_size = int(processor.get_set_size())
+    weights = np.random.default_rng(seed).integers(
+        0, np.iinfo(np.uint64).max, size=3 * set_size, dtype=np.uint64,
+        endpoint=True)
+    hashes = np.empty(num_samples, dtype=np.uint64)
+    for start in range(0, num_samples, block_size):
+        x, y = processor.get_batch(np.arange(start, min(start + block_size, num_samples)))
+        hashes[start:start + len(x)] = (x.astype(np.uint64) @ weights[:2 * set_size]
+                                        + weights[2 * set_size + np.argmax(y, axis=1)])
+
+    _, first_idx, counts = np.unique(hashes, return_index=True, return_counts=True)
+    del hashes
+    order = np.argsort(first_idx)
+    first_idx = first_idx[order]
+    counts = counts[order]
+
+    indptrs = []
+    indices = []
+    data = []
+    picks = []
+    num_nonzero = 0
+    for start in range(0, len(first_idx), block_size):
+        x, y = processor.get_batch(first_idx[start:start + block_size])
+        block_indptr, block_indices, block_data = dense_to_csr(x)
+        indptrs.append(block_indptr[1:] + num_nonzero)
+        indices.append(block_indices)
+        data.append(block_data.astype(np.uint8))
+        picks.append(np.argmax(y, axis=1).astype(np.int16))
+        num_nonzero += block_indptr[-1]
+    return {'data_format': 'csr',
+            'indptr': np.concatenate([np.zeros(1, dtype=np.int64)] + indptrs),
+            'indices': np.concatenate(indices),
+            'data': np.concatenate(data),
+            'pick': np.concatenate(picks),
+            'count': counts.astype(np.uint32),
+            'num_cards_in_set': set_size}
+
+
+class IndexPermutation:
+    def __init__(self, num_samples, rng=None, num_rounds=4):
+        """Pseudorandom permutation of range(num_samples) that is never
+        materialized: position i maps to index take(i, i + 1)[0], computed
+        with a keyed Feistel network over the smallest even number of bits
+        that covers num_samples, and cycle walking for the values outside of
+        range(num_samples). The round keys are drawn from rng, so the same rng
+        state gives the same order. Any range of positions can be computed on
+        its own, which makes a pass resumable from any position.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        self.num_samples = int(num_samples)
+        self.half_bits = max((max(self.num_samples - 1, 0).bit_length() + 1) // 2, 1)
+        self.half_mask = np.uint64((1 << self.half_bits) - 1)
+        self.keys = rng.integers(0, np.iinfo(np.uint64).max, size=num_rounds,
+                                 dtype=np.uint64, endpoint=True)
+
+    def _round(self, right, key):
+        #splitmix64 style mixing of the keyed half
+        x = right ^ key
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        x = x ^ (x >> np.uint64(31))
+        return x & self.half_mask
+
+    def _feistel(self, values):
+        shift = np.uint64(self.half_bits)
+        left = values >> shift
+        right = values & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << shift) | right
+
+    def take(self, start, stop):
+        """Permuted indices of positions start:stop, as int64.
+        """
+        positions = np.arange(start, min(stop, self.num_samples), dtype=np.uint64)
+        out = self._feistel(positions)
+        outside = np.nonzero(out >= self.num_samples)[0]
+        while len(outside):
+            out[outside] = self._feistel(out[outside])
+            outside = outside[out[outside] >= self.num_samples]
+        return out.astype(np.int64)
+
+    def __len__(self):
+        return self.num_samples
+
+
 class BaseDataProcessor:
     def __init__(self,**kwargs):
         raise NotImplementedError
@@ -28,9 +242,80 @@ class BaseDataProcessor:
     def __getitem__(self, index):
         raise NotImplementedError
 
-    def get_iter(self):
+    def get_batch(self, indices):
         raise NotImplementedError
 
+    def get_iter(self, shuffle=True, block_size=4096):
+        """Yields (x, y) samples forever, one at a time. Every epoch is
+        shuffled with an IndexPermutation, computed block_size positions at a
+        time.
+        """
+        rng = np.random.default_rng()
+        num_samples = self.__len__()
+        while True:
+            permutation = IndexPermutation(num_samples, rng)
+            for start in range(0, num_samples, block_size):
+                if shuffle:
+                    indices = permutation.take(start, start + block_size)
+                else:
+                    indices = range(start, min(start + block_size, num_samples))
+                for idx in indices:
+                    yield self.__getitem__(idx)
+
+    def has_sample_weights(self):
+        return False
+
+    def get_sample_weights(self, indices):
+        """Training weight of the samples in indices, None if the samples
+        aren't weighted.
+        """
+        return None
+
+    def get_batch_iter(self, batch_size, shuffle=True, worker_idx=0,
+                       num_workers=1, seed=None, start_batch=0):
+        """Yields (x, y) batches forever, built with get_batch.
+        Every epoch the indices are shuffled with an IndexPermutation (with
+        the same seed, all workers get the same order) and split into blocks
+        of batch_size, worker worker_idx yields blocks worker_idx,
+        worker_idx + num_workers, ... so num_workers workers cover each epoch
+        once between them.
+        Indices are sorted within a batch, for memory locality.
+        For weighted samples (see get_sample_weights), the batches are
+        (x, y, sample_weight).
+        start_batch is the number of this worker's batches to skip, the
+        iterator resumes where one that yielded start_batch batches stopped,
+        without building the skipped batches.
+        """
+        rng = np.random.default_rng(seed)
+        num_samples = self.__len__()
+        starts = range(worker_idx * batch_size, num_samples,
+                       num_workers * batch_size)
+        skip_epochs, skip_batches = divmod(start_batch, max(len(starts), 1))
+        for _ in range(skip_epochs):
+            #advances rng past the skipped epochs' permutations
+            IndexPermutation(num_samples, rng)
+        while True:
+            permutation = IndexPermutation(num_samples, rng)
+            epoch_starts = starts[skip_batches:]
+            skip_batches = 0
+            for start in epoch_starts:
+                if shuffle:
+                    indices = permutation.take(start, start + batch_size)
+                else:
+                    indices = np.arange(start, min(start + batch_size, num_samples))
+                indices = np.sort(indices)
+                sample_weights = self.get_sample_weights(indices)
+                if sample_weights is None:
+                    yield self.get_batch(indices)
+                else:
+                    yield self.get_batch(indices) + (sample_weights,)
+
+    def get_num_workers(self, batch_size, num_workers):
+        """Number of get_batch_iter workers to use out of num_workers, so
+        that every worker gets batches.
+        """
+        return max(min(num_workers, -(-self.__len__() // batch_size)), 1)
+
     def __len__(self):
         raise NotImplementedError
 
@@ -39,25 +324,94 @@ class BaseDataProcessor:
 
 
 class SparseFormatProcessor(BaseDataProcessor):
-    def __init__(self, data_dict,**kwargs):
-        self.x = data_dict['x']
-        self.y = data_dict['y']
-        self.len = self.y.shape[0]
-        self.num_cards_in_set = self.y.shape[1]
+    def __init__(self, data_dict, num_cards_in_set=None, **kwargs):
+        """Rows of [pool counts, pack flags] and the picked card.
+        data_dict either holds the dense 'x' and one-hot 'y' arrays, or
+        (data_format 'csr') x as CSR 'indptr', 'indices', 'data' arrays and
+        'pick', the picked card index. CSR rows are densified per batch.
+        With data_format 'packed', the CSR arrays only hold the pool half and
+        the pack flags are np.packbits rows in 'pack_bits', unpacked per batch.
+        Deduplicated data (see dedup_samples) has the number of copies of
+        each sample in 'count', the samples are weighted by count/mean(count).
+        """
+        self.is_csr = data_dict['data_format'] in ('csr', 'packed')
+        self.pack_bits = None
+        self.sample_weights = None
+        if self.is_csr:
+            if data_dict['data_format'] == 'packed':
+                self.pack_bits = data_dict['pack_bits']
+            self.indptr = data_dict['indptr']
+            self.indices = data_dict['indices']
+            self.data = data_dict['data']
+            self.pick = data_dict['pick']
+            self.len = self.pick.shape[0]
+            if 'count' in data_dict:
+                counts = np.asarray(data_dict['count'], dtype=np.float32)
+                self.sample_weights = counts / np.mean(counts)
+            if num_cards_in_set is None:
+                num_cards_in_set = data_dict['num_cards_in_set']
+            self.num_cards_in_set = int(num_cards_in_set)
+            self._buffers = threading.local()
+        else:
+            self.x = data_dict['x']
+            self.y = data_dict['y']
+            self.len = self.y.shape[0]
+            self.num_cards_in_set = self.y.shape[1]
 
     def __getitem__(self, index):
+        if self.is_csr:
+            x, y = self.get_batch([index])
+            return x[0].copy(), y[0].copy()
         return self.x[index], self.y[index]
 
-    def get_iter(self,shuffle=True):
-        
-        indices = np.arange(self.__len__())
-        while True:
-            if shuffle:
-                np.random.shuffle(indices)
-            
-            for idx in indices:
-                yield self.__getitem__(idx)
-    
+    def get_batch(self, indices):
+        if self.is_csr:
+            return self.densify_batch(indices)
+        return self.x[indices], self.y[indices]
+
+    def has_sample_weights(self):
+        return self.sample_weights is not None
+
+    def get_sample_weights(self, indices):
+        if self.sample_weights is None:
+            return None
+        return self.sample_weights[indices]
+
+    def _get_buffers(self, batch_size):
+        """Per thread x and y buffers, reused while the batch size fits.
+        """
+        buffers = self._buffers
+        if getattr(buffers, 'x', None) is None or len(buffers.x) < batch_size:
+            buffers.x = np.zeros((batch_size, 2 * self.num_cards_in_set),
+                                 dtype=np.uint8)
+            buffers.y = np.zeros((batch_size, self.num_cards_in_set),
+                                 dtype=np.uint8)
+        return buffers.x[:batch_size], buffers.y[:batch_size]
+
+    def densify_batch(self, indices):
+        """Dense x and y for the CSR rows in indices. The arrays are views of
+        reused buffers, they are overwritten by the next call in the same
+        thread.
+        """
+        indices = np.asarray(indices)
+        batch_size = len(indices)
+        x, y = self._get_buffers(batch_size)
+        x[:] = 0
+        y[:] = 0
+
+        starts = self.indptr[indices]
+        lengths = self.indptr[indices + 1] - starts
+        rows = np.repeat(np.arange(batch_size), lengths)
+        row_offsets = np.cumsum(lengths) - lengths
+        positions = (np.repeat(starts - row_offsets, lengths)
+                     + np.arange(len(rows)))
+        x[rows, self.indices[positions]] = self.data[positions]
+        if self.pack_bits is not None:
+            x[:, self.num_cards_in_set:] = np.unpackbits(
+                self.pack_bits[indices], axis=1, count=self.num_cards_in_set)
+        y[np.arange(batch_size), self.pick[indices]] = 1
+        return x, y
+
     def __len__(self):
         return self.len
 
@@ -71,6 +425,8 @@ class DraftFormatProcessor(BaseDataProcessor):
         if num_cards_in_set is None:
             self.num_cards_in_set = np.max(drafts_tensor) + 1
             print('inferring the number of cards in set: {}'.format(self.num_cards_in_set))
+        else:
+            self.num_cards_in_set = num_cards_in_set
         # self.pack_size = int(self.drafts_tensor.shape[1]/3)
         # self.draft_size = self.pack_size*3
         self.pack_size = self.drafts_tensor.shape[2]
@@ -88,15 +444,39 @@ class DraftFormatProcessor(BaseDataProcessor):
         y = self.create_new_y(pick_num, draft_num)
         return x, y
     
-    def get_iter(self,shuffle=True):
-        
-        indices = np.arange(self.__len__())
-        while True:
-            if shuffle:
-                np.random.shuffle(indices)
-            
-            for idx in indices:
-                yield self.__getitem__(idx)
+    def get_batch(self, indices):
+        """Return the training examples for indices, stacked.
+        Same x and y as __getitem__, built for the whole batch at once.
+        """
+        indices = np.asarray(indices)
+        pick_nums = indices % self.draft_size
+        draft_nums = (indices - pick_nums) // self.draft_size
+        batch_size = len(indices)
+        num_cards = int(self.num_cards_in_set)
+
+        rows = np.arange(batch_size)[:, None]
+        x = np.zeros([batch_size, num_cards * 2], dtype = "int16")
+
+        #Collection vector: count the picks made before pick_num. Later picks
+        #are counted in an extra dummy card column, which is dropped.
+        picked = self.drafts_tensor[draft_nums, :, 0]
+        before_pick = np.arange(self.draft_size)[None, :] < pick_nums[:, None]
+        keys = rows * (num_cards + 1) + np.where(before_pick, picked, num_cards)
+        collection = np.bincount(keys.ravel(),
+                                 minlength=batch_size * (num_cards + 1))
+        x[:, :num_cards] = collection.reshape(batch_size, num_cards + 1)[:, :num_cards]
+
+        #Pack vector. Slots past the cards in the pack repeat the first card.
+        packs = self.drafts_tensor[draft_nums, pick_nums]
+        cards_in_pack = self.pack_size - pick_nums % self.pack_size
+        in_pack = np.arange(self.pack_size)[None, :] < cards_in_pack[:, None]
+        packs_in_pack = np.where(in_pack, packs, packs[:, :1])
+        x[rows, packs_in_pack + num_cards] = 1
+
+        #Target, the picked card is the first card of the pack.
+        y = np.zeros([batch_size, num_cards], dtype = "int16")
+        y[rows[:, 0], packs[:, 0]] = 1
+        return x, y
     
     def create_new_x(self, pick_num, draft_num):
         """Generate x, input, as a row vector.
@@ -138,6 +518,44 @@ class DraftFormatProcessor(BaseDataProcessor):
         return len(self.drafts_tensor) * self.draft_size
 
 
+class MixedFormatProcessor(BaseDataProcessor):
+    def __init__(self, data_dict, num_cards_in_set=None, **kwargs):
+        """Complete drafts as a draft tensor ('drafts', see
+        DraftFormatProcessor) followed by the rows of the other drafts as
+        csr arrays (see SparseFormatProcessor).
+        Samples 0:len(drafts)*draft_size are the draft tensor ones.
+        """
+        if num_cards_in_set is None:
+            num_cards_in_set = data_dict['num_cards_in_set']
+        self.num_cards_in_set = int(num_cards_in_set)
+        self.draft_processor = DraftFormatProcessor(
+            data_dict['drafts'], num_cards_in_set=self.num_cards_in_set)
+        csr_dict = {name: data_dict[name]
+                    for name in ('indptr', 'indices', 'data', 'pick')}
+        csr_dict['data_format'] = 'csr'
+        self.csr_processor = SparseFormatProcessor(
+            csr_dict, num_cards_in_set=self.num_cards_in_set)
+        self.num_draft_samples = len(self.draft_processor)
+
+    def __getitem__(self, index):
+        if index < self.num_draft_samples:
+            return self.draft_processor[index]
+        return self.csr_processor[index - self.num_draft_samples]
+
+    def get_batch(self, indices):
+        indices = np.asarray(indices)
+        in_drafts = indices < self.num_draft_samples
+        x = np.empty((len(indices), 2 * self.num_cards_in_set), dtype=np.int16)
+        y = np.empty((len(indices), self.num_cards_in_set), dtype=np.int16)
+        x[in_drafts], y[in_drafts] = self.draft_processor.get_batch(indices[in_drafts])
+        x[~in_drafts], y[~in_drafts] = self.csr_processor.get_batch(
+            indices[~in_drafts] - self.num_draft_samples)
+        return x, y
+
+    def __len__(self):
+        return self.num_draft_samples + len(self.csr_processor)
+
+
 def create_set_vector(casting_cost, card_type, rarity, color_vector):
     """
     Returns a feature-encoded card property vector. 